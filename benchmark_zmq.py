@@ -0,0 +1,282 @@
+#*Benchmarks for utilities_zmq.
+#*Run with: python benchmark_zmq.py
+#*Each benchmark prints rates or latencies so a change to utilities_zmq can be compared before and after.
+
+#*round_trips is the one to check changes against. It starts a server and clients with start_multiprocess and for every combination of
+#*payload size, client count and dont_log_args measures
+#*  call round trip latency percentiles, calls one after another going round the clients
+#*  one way throughput, sends to the clients as fast as they go
+#*  CPU per message, server and client CPU time used by the throughput sends over how many there were
+#*Each combination is measured --repeats times and the median of each metric is the result, a single run's tail is mostly noise.
+#*The results are written to --output as JSON. With --baseline each result is compared against the same one in a stored run.
+#*A metric is a regression when it's worse by more than its tolerance, and for latencies and CPU by more than NOISE_FLOOR_US too.
+#*p50 and throughput use --tolerance, the tail percentiles and CPU are noisier and use --tail-tolerance and --cpu-tolerance.
+#*Regressions make the exit code 1, as long as there were at least MIN_GATE_REPEATS repeats to take medians of.
+#*  python benchmark_zmq.py --benchmarks round_trips --output before.json
+#*  python benchmark_zmq.py --benchmarks round_trips --baseline before.json
+
+import time
+import argparse
+import statistics
+import itertools
+import platform
+import json
+import sys
+import os
+from pathlib import Path
+from datetime import datetime
+
+import zmq
+
+from utilities_zmq import ZMQMessage, ZMQServer, ZMQClient, CODECS, get_codec, available_transports
+from utilities_log import log_start
+from utilities import write_atomically
+
+class BenchmarkClient(ZMQClient):
+    def echo(self, *args):
+        return args
+
+    def sink(self, *args):
+        pass
+
+    def cpu(self):
+        return time.process_time()
+
+def sample_message(payload_size=100):
+    return ZMQMessage(server='main', client='test', function='read', args=[1.5, 2, 'three'], kwargs={'channel': 4},
+                      return_=list(range(payload_size)), status='success', times=[time.time()]*4, id_=12345)
+
+def codec_round_trip(codec, message, count=100000):
+    """Encode then decode the same message count times. Returns messages per second."""
+    start = time.perf_counter()
+    for _ in range(count):
+        codec.decode(codec.encode(message))
+    return count / (time.perf_counter() - start)
+
+def socket_round_trip(codec, message, count=20000):
+    """Send the message over an inproc PAIR socket and decode it on the other end. Returns messages per second."""
+    context = zmq.Context()
+    sender = context.socket(zmq.PAIR)
+    receiver = context.socket(zmq.PAIR)
+    sender.bind('inproc://benchmark')
+    receiver.connect('inproc://benchmark')
+
+    try:
+        start = time.perf_counter()
+        for _ in range(count):
+            sender.send_multipart(codec.encode(message))
+            codec.decode(receiver.recv_multipart())
+        return count / (time.perf_counter() - start)
+    finally:
+        sender.close()
+        receiver.close()
+        context.term()
+
+def benchmark_codecs(payload_sizes=(10, 1000), count=20000):
+    for payload_size in payload_sizes:
+        message = sample_message(payload_size)
+        print(f'payload of {payload_size} ints')
+        for name in CODECS:
+            try:
+                codec = get_codec(name)
+            except ImportError as e:
+                print(f'    {name:<8} skipped, {e}')
+                continue
+
+            size = sum(len(frame) for frame in codec.encode(message))
+            codec_rate = codec_round_trip(codec, message, count)
+            socket_rate = socket_round_trip(codec, message, count)
+            print(f'    {name:<8} {size:>8} bytes  {codec_rate:>10,.0f} encode+decode/s  {socket_rate:>10,.0f} socket round trips/s')
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values)-1, int(p/100*len(sorted_values)))]
+
+def call_latencies(server: ZMQServer, client: str, count=2000, args=()):
+    """Times count calls one after another. Returns the sorted round trip times in microseconds."""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        server.call(client, 'echo', list(args)).result()
+        latencies.append((time.perf_counter() - start)*1e6)
+    latencies.sort()
+    return latencies
+
+def benchmark_transports(count=2000, port=7555):
+    """Round trip latency of a call for each transport. tcp and ipc clients are separate processes, inproc is a thread."""
+    print('call round trip latency')
+    for transport in available_transports():
+        server = ZMQServer(send_port=port, recv_port=port+1, transports=[transport])
+        port += 2
+
+        if transport == 'inproc':
+            server.start_thread(BenchmarkClient, 'benchmark')
+        else:
+            server.start_multiprocess(BenchmarkClient, 'benchmark', transport=transport)
+        server.wait_for_all_clients_ready()
+
+        call_latencies(server, 'benchmark', count=count//10)#warm up
+        latencies = call_latencies(server, 'benchmark', count=count)
+        print(f'    {transport:<8} p50 {percentile(latencies, 50):>8.1f} us  p99 {percentile(latencies, 99):>8.1f} us  mean {statistics.fmean(latencies):>8.1f} us')
+
+        server.close()
+
+#*Whether more or less is better for each metric compared against a baseline
+LOWER_IS_BETTER = ('rtt_p50_us', 'rtt_p90_us', 'rtt_p99_us', 'cpu_us_per_message')
+HIGHER_IS_BETTER = ('throughput',)
+TAIL_METRICS = ('rtt_p90_us', 'rtt_p99_us')
+CPU_METRICS = ('cpu_us_per_message',)
+NOISE_FLOOR_US = 50#latency and CPU changes smaller than this many microseconds are never a regression
+MIN_GATE_REPEATS = 3
+
+def round_trip_key(result: dict) -> str:
+    return f'{result["clients"]} clients, {result["payload_size"]} B, dont_log_args={result["dont_log_args"]}'
+
+def throughput(server: ZMQServer, clients: list, payload: str, dont_log_args: bool, count=5000) -> tuple:
+    """Sends count messages round the clients without waiting, then a call to each so it's known they've all been handled.
+    Returns (messages per second, CPU microseconds per message) where the CPU is this process's plus the clients'.
+    """
+    cpu_before = time.process_time() + sum(future.result().return_ for future in [server.call(client, 'cpu') for client in clients])
+    start = time.perf_counter()
+
+    for index in range(count):
+        server.send(clients[index % len(clients)], 'sink', [payload], dont_log_args=dont_log_args)
+        if index % 100 == 0:
+            server.recv_many(timeout=0)#the replies to the sends
+    cpu_after = sum(future.result().return_ for future in [server.call(client, 'cpu') for client in clients])
+    seconds = time.perf_counter() - start
+    cpu_after += time.process_time()
+
+    while server.recv_many(timeout=0):
+        pass
+
+    return count/seconds, (cpu_after - cpu_before)/count*1e6
+
+def measure_round_trips(server: ZMQServer, clients: list, payload: str, dont_log: bool, count: int) -> dict:
+    """One run of every metric for one combination."""
+    client_cycle = itertools.cycle(clients)
+
+    for _ in range(count//10):#warm up
+        server.call(next(client_cycle), 'echo', [payload], dont_log_args=dont_log).result()
+
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        server.call(next(client_cycle), 'echo', [payload], dont_log_args=dont_log).result()
+        latencies.append((time.perf_counter() - start)*1e6)
+    latencies.sort()
+
+    rate, cpu = throughput(server, clients, payload, dont_log, count=count*2)
+
+    return {
+        'rtt_p50_us': percentile(latencies, 50),
+        'rtt_p90_us': percentile(latencies, 90),
+        'rtt_p99_us': percentile(latencies, 99),
+        'rtt_mean_us': statistics.fmean(latencies),
+        'throughput': rate,
+        'cpu_us_per_message': cpu,
+    }
+
+def benchmark_round_trips(payload_sizes=(10, 1000, 100000), client_counts=(1, 4), dont_log_args=(False, True), count=2000, port=7655, repeats=5) -> list:
+    """See the top of this file. Returns a result dictionary for every combination, each metric the median of repeats runs."""
+    results = []
+    for client_count in client_counts:
+        server = ZMQServer(send_port=port, recv_port=port+1)
+        port += 2
+        clients = [f'benchmark_{index}' for index in range(client_count)]
+        for client in clients:
+            server.start_multiprocess(BenchmarkClient, client)
+        server.wait_for_all_clients_ready()
+
+        for payload_size, dont_log in itertools.product(payload_sizes, dont_log_args):
+            payload = 'x'*payload_size
+            runs = [measure_round_trips(server, clients, payload, dont_log, count) for _ in range(repeats)]
+
+            result = {
+                'clients': client_count,
+                'payload_size': payload_size,
+                'dont_log_args': dont_log,
+                'repeats': repeats,
+                **{metric: statistics.median(run[metric] for run in runs) for metric in runs[0]},
+                'runs': runs,
+            }
+            results.append(result)
+            print(f'    {round_trip_key(result):<45} p50 {result["rtt_p50_us"]:>8.1f} us  p99 {result["rtt_p99_us"]:>8.1f} us  '
+                  f'{result["throughput"]:>10,.0f} msg/s  {result["cpu_us_per_message"]:>7.1f} us CPU/msg  (median of {repeats})')
+
+        server.close()
+    return results
+
+def save_results(results: list, path):
+    run = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'zmq': zmq.zmq_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    write_atomically(path, json.dumps(run, indent=4))
+
+def compare_results(results: list, baseline_path, tolerance=0.25, tail_tolerance=0.5, cpu_tolerance=0.5, noise_floor_us=NOISE_FLOOR_US) -> list:
+    """Prints how each result changed from the baseline. Returns the regressions, (key, metric, baseline, now) for each."""
+    baseline = {round_trip_key(result): result for result in json.loads(Path(baseline_path).read_text())['results']}
+
+    regressions = []
+    print(f'compared to {baseline_path}')
+    for result in results:
+        key = round_trip_key(result)
+        if key not in baseline:
+            print(f'    {key:<45} not in the baseline')
+            continue
+
+        changes = []
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            before, now = baseline[key][metric], result[metric]
+            if not before:
+                continue
+            change = now/before - 1
+            if metric in HIGHER_IS_BETTER:
+                worse = change < -tolerance
+            else:
+                allowed = tail_tolerance if metric in TAIL_METRICS else cpu_tolerance if metric in CPU_METRICS else tolerance
+                worse = change > allowed and now - before > noise_floor_us
+            if worse:
+                regressions.append((key, metric, before, now))
+            changes.append(f'{metric} {change:+.0%}{" REGRESSION" if worse else ""}')
+        print(f'    {key:<45} {", ".join(changes)}')
+
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for utilities_zmq')
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--benchmarks', nargs='+', default=['codecs', 'transports'], choices=['codecs', 'transports', 'round_trips'])
+    parser.add_argument('--payload-sizes', nargs='+', type=int, default=[10, 1000, 100000])
+    parser.add_argument('--clients', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--dont-log-args', nargs='+', choices=['false', 'true'], default=['false', 'true'])
+    parser.add_argument('--trace', type=int, default=100, help='Trace setting for the server and clients, see log_start. 0 turns tracing off')
+    parser.add_argument('--output', default='logs/benchmarks/round trips.json', help='Where round_trips writes its results')
+    parser.add_argument('--baseline', help='Results from an earlier run to compare round_trips against')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs of each round_trips combination, the results are their medians')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='How much worse than the baseline p50 and throughput can be, 0.25 is 25%%')
+    parser.add_argument('--tail-tolerance', type=float, default=0.5, help='The same for p90 and p99')
+    parser.add_argument('--cpu-tolerance', type=float, default=0.5, help='The same for CPU per message')
+    args = parser.parse_args()
+
+    if 'codecs' in args.benchmarks:
+        benchmark_codecs(count=args.count)
+    if 'transports' in args.benchmarks:
+        benchmark_transports(count=args.count//10)
+    if 'round_trips' in args.benchmarks:
+        log_start('benchmark', trace=args.trace)#so dont_log_args has the logging to skip
+        print('round trips')
+        results = benchmark_round_trips(args.payload_sizes, args.clients, [value == 'true' for value in args.dont_log_args], count=args.count//10, repeats=args.repeats)
+        save_results(results, args.output)
+        print(f'results written to {args.output}')
+
+        if args.baseline is not None:
+            regressions = compare_results(results, args.baseline, args.tolerance, args.tail_tolerance, args.cpu_tolerance)
+            if regressions and args.repeats < MIN_GATE_REPEATS:
+                print(f'not failing on {len(regressions)} regressions from {args.repeats} repeats, it takes {MIN_GATE_REPEATS} to trust the medians')
+            elif regressions:
+                sys.exit(1)
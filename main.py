@@ -32,18 +32,19 @@ class Main(StateMachine):
 
     def main_state(self):
         #*-->ENTER STATE
-        pass
+        self.on_message(self.handle_message)
+        self.reactor.add_gui(self.gui.update)
+        self.reactor.call_every(0.2, self.spinner.spin)
 
         #*-->RUN STATE-->
-        while self.gui.update():
-            try:
-                self.spinner.spin()
-
-                message = self.recv()
+        try:
+            return self.react()#returns None when the window is closed
+        except KeyboardInterrupt:
+            #*EXIT STATE-->
+            return None
 
-            except KeyboardInterrupt:
-                #*EXIT STATE-->
-                return None
+    def handle_message(self, message):
+        pass
           
     def state(self):
         #*-->ENTER STATE
@@ -0,0 +1,173 @@
+import json
+import math
+import time
+
+import pytest
+
+from utilities import RollingList, TimedRollingList, RollingArray, Timer, TimerScheduler, Settings
+
+NAN = float('nan')
+
+def rolling_list(values):
+    rolling = RollingList(length=len(values))
+    for value in values:
+        rolling.append(value)
+    return rolling
+
+def test_nan_fails_the_checks():
+    rolling = rolling_list([0.1, NAN, 0.2])
+    assert rolling.all_less_than(1) is False
+    assert rolling.all_greater_than(0) is False
+    assert rolling.within(0.5) is False
+    assert math.isnan(rolling.min)
+    assert math.isnan(rolling.max)
+    assert math.isnan(rolling.mean)
+
+    assert rolling_list([NAN, 0.9]).within(0.5) is False
+
+def test_checks_recover_once_the_nan_is_pushed_out():
+    rolling = rolling_list([0.1, NAN, 0.2])
+    rolling.append(0.3)
+    rolling.append(0.4)
+    assert rolling.all_less_than(1) is True
+    assert rolling.all_greater_than(0) is True
+    assert rolling.within(0.5) is True
+    assert (rolling.min, rolling.max) == (0.2, 0.4)
+    assert math.isclose(rolling.mean, 0.3)
+
+def test_infinities():
+    rolling = rolling_list([1.0, math.inf, -math.inf])
+    assert rolling.min == -math.inf
+    assert rolling.max == math.inf
+    assert math.isnan(rolling.sum)
+    rolling.append(2.0)
+    rolling.append(3.0)
+    assert rolling.min == -math.inf
+    rolling.append(4.0)
+    assert (rolling.min, rolling.max, rolling.sum) == (2.0, 4.0, 9.0)
+
+def test_values_whose_squares_overflow():
+    rolling = rolling_list([1e300, -1e300, 1.0])
+    rolling.append(2.0)
+    rolling.append(3.0)
+    assert (rolling.mean, rolling.sum, rolling.variance) == (2.0, 6.0, 2/3)
+    assert (rolling.min, rolling.max) == (1.0, 3.0)
+
+def test_timed_rolling_list_nan():
+    now = [0.0]
+    rolling = TimedRollingList(1, clock=lambda: now[0])
+    for value in (0.1, NAN, 0.2):
+        now[0] += 0.5
+        rolling.append(value)
+    assert rolling.all_less_than(1) is False
+    now[0] += 0.6
+    rolling.append(0.3)
+    assert rolling.all_less_than(1) is True
+
+def test_timed_rolling_list_last_value_expires():
+    now = [0.0]
+    rolling = TimedRollingList(1, clock=lambda: now[0])
+    try:
+        rolling.last_value
+    except IndexError:
+        pass
+    else:
+        assert False, 'an empty TimedRollingList has no last value'
+
+    rolling.append(1.0)
+    assert rolling.last_value == 1.0
+    now[0] += 2
+    try:
+        rolling.last_value
+    except IndexError as error:
+        assert 'empty' in str(error)
+    else:
+        assert False, 'the value is older than the span'
+
+def test_rolling_array_keeps_order_across_wraps():
+    pytest.importorskip('numpy')
+    rolling = RollingArray(length=4)
+    assert rolling._buffer.nbytes == 4*8
+    rolling.extend([1.0, 2.0, 3.0])
+    for value in (4.0, 5.0, 6.0):
+        rolling.append(value)
+    assert rolling.values.tolist() == [3.0, 4.0, 5.0, 6.0]
+    assert rolling.last_value == 6.0
+    rolling.extend([7.0, 8.0])
+    rolling.append(9.0)
+    assert rolling.values.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert (rolling.min, rolling.max, rolling.mean) == (6.0, 9.0, 7.5)
+
+def finish(timer: Timer, ago=0.0):
+    """Moves the timer's start back so it finished ago seconds ago."""
+    timer.start_time = time.monotonic() - timer.timeout - ago
+
+def test_timer_scheduler_runs_due_timers_earliest_first():
+    scheduler = TimerScheduler()
+    ran = []
+    timers = [scheduler.add(Timer(60), callback=ran.append) for _ in range(3)]
+    assert scheduler.run_due() == 0
+    assert 59 < scheduler.time_until_next() <= 60
+
+    finish(timers[2], ago=2)
+    finish(timers[0], ago=1)
+    assert scheduler.run_due() == 2
+    assert ran == [timers[2], timers[0]]
+    assert len(scheduler) == 1 and timers[1] in scheduler#only repeating timers stay
+
+def test_timer_scheduler_repeats_on_schedule():
+    scheduler = TimerScheduler()
+    timer = scheduler.add(Timer(60), repeat=True)
+    finish(timer, ago=150)#two and a half timeouts late
+    assert list(scheduler.expired()) == [timer]
+    assert list(scheduler.expired()) == []#moved on to the next whole timeout, not run three times
+    assert timer in scheduler and 29 < timer.remaining <= 30
+
+def test_timer_scheduler_keeps_up_with_changes():
+    scheduler = TimerScheduler()
+    timer = scheduler.add(Timer(60))
+    finish(timer)
+    timer.reset()#pushed back out, its old heap entry is stale
+    assert scheduler.run_due() == 0
+
+    finish(timer)
+    timer.off = True
+    assert scheduler.run_due() == 0
+    assert timer in scheduler
+    timer.on = True
+    assert scheduler.run_due() == 1
+
+    other = scheduler.add(Timer(60))
+    scheduler.remove(other)
+    finish(other)
+    assert scheduler.run_due() == 0 and scheduler.time_until_next() is None
+
+def test_settings_are_written_together_and_keep_other_processes_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'settings' / 'settings.json'
+    settings = Settings(flush_delay=60)
+    settings.ramp_time = 5
+    assert json.loads(path.read_text())['ramp_time'] == 10#not until the flush
+
+    written = json.loads(path.read_text())
+    written['alarm_wait'] = 30#another process
+    path.write_text(json.dumps(written))
+
+    settings.flush()
+    written = json.loads(path.read_text())
+    assert (written['ramp_time'], written['alarm_wait']) == (5, 30)
+    assert list(path.parent.iterdir()) == [path]#no temporary file left behind
+
+def test_settings_batch_is_undone_if_it_raises(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = Settings(flush_delay=0)
+    try:
+        with settings.batch():
+            settings.ramp_time = 5
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert settings.ramp_time == 10
+    settings.flush()
+    assert json.loads((tmp_path / 'settings' / 'settings.json').read_text())['ramp_time'] == 10
+
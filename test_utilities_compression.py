@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from utilities_compression import Compression, COMPRESSORS
+from utilities_zmq import ZMQMessage, get_codec
+
+def compressors() -> list:
+    """Every compressor that can be made here, zstd and lz4 are optional."""
+    made = []
+    for name in COMPRESSORS:
+        try:
+            COMPRESSORS[name]()
+        except ImportError:
+            continue
+        made.append(name)
+    return made
+
+PAYLOAD = b'{"waveform": [1, 2, 3, 4, 5, 6, 7, 8]}' * 200
+
+@pytest.mark.parametrize('name', compressors())
+def test_round_trip(name):
+    compression = Compression(name, threshold=100)
+    compressed, compressor_id = compression.compress(PAYLOAD)
+    assert compressor_id == COMPRESSORS[name].compressor_id
+    assert len(compressed) < len(PAYLOAD)
+
+    #*The receiver wasn't told which compressor, only the id
+    assert Compression().decompress(compressed, compressor_id) == PAYLOAD
+    assert compression.stats.ratio > 1
+
+def test_small_and_incompressible_payloads_are_sent_as_they_are():
+    compression = Compression('zlib', threshold=100)
+    assert compression.compress(b'x' * 99) == (b'x' * 99, 0)
+
+    random = os.urandom(1000)
+    assert compression.compress(random) == (random, 0)
+    assert compression.stats.skipped == 1
+
+def test_unknown_compressor():
+    with pytest.raises(KeyError):
+        Compression('brotli')
+    with pytest.raises(ValueError):
+        Compression().decompress(b'', 7)
+
+@pytest.mark.parametrize('name', compressors())
+def test_compressed_message_round_trip(name):
+    codec = get_codec('json')
+    codec.compression = Compression(name, threshold=100)
+    message = ZMQMessage(client='test', function='plot', args=['x' * 5000], id_=3)
+    frames = codec.encode(message)
+    assert len(frames[1]) < 5000
+
+    receiver = get_codec('json')
+    assert receiver.decode(frames).to_dict() == message.to_dict()
@@ -0,0 +1,75 @@
+import pytest
+
+from utilities_flow import FlowControl
+from utilities_zmq import ZMQMessage
+
+def messages(*ids) -> list:
+    return [ZMQMessage(client='test', function='add', id_=id_) for id_ in ids]
+
+def ids(batches) -> list:
+    return [message.id_ for batch in batches for message in batch]
+
+def test_credits():
+    flow = FlowControl(credits=2, queue_size=10)
+    flow.take(messages(0))
+    assert flow.ready(1) and not flow.ready(2)
+    flow.take(messages(1))
+    assert not flow.ready() and flow.in_flight == 2
+    assert flow.release(0) and not flow.release(0)
+    assert flow.ready()
+
+    #*A batch bigger than all the credits still goes once nothing is in flight
+    flow.release(1)
+    assert flow.ready(5)
+
+def test_queue_goes_out_as_replies_come_back():
+    flow = FlowControl(credits=1, queue_size=10)
+    flow.take(messages(0))
+    flow.enqueue(messages(1))
+    flow.enqueue(messages(2, 3))
+    assert not flow.ready() and flow.queue_length == 3
+    assert flow.next_ready() is None
+
+    flow.release(0)
+    batch = flow.next_ready()
+    assert ids([batch]) == [1]
+    flow.take(batch)
+    flow.release(1)
+    assert ids([flow.next_ready()]) == [2, 3]#a batch bigger than the credits goes on its own
+    assert flow.queue_length == 0
+
+@pytest.mark.parametrize('policy, dropped, kept', [
+    ('drop-oldest', [1], [2, 3]),
+    ('drop-newest', [3], [1, 2]),
+    ('block', [3], [1, 2]),#by the time block gets to enqueue it has waited, so the new one goes
+])
+def test_drop_policies(policy, dropped, kept):
+    flow = FlowControl(credits=1, queue_size=2, policy=policy)
+    flow.take(messages(0))
+    assert flow.enqueue(messages(1)) == []
+    assert flow.enqueue(messages(2)) == []
+    assert flow.full()
+
+    assert [message.id_ for message in flow.enqueue(messages(3))] == dropped
+    assert ids(flow.queue) == kept
+    assert flow.dropped == 1
+    assert flow.queue_length == 2
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FlowControl(policy='drop-random')
+
+def test_discard_and_reset():
+    flow = FlowControl(credits=1, queue_size=10)
+    flow.take(messages(0))
+    batch = messages(1, 2)
+    flow.enqueue(batch)
+    flow.enqueue(messages(3))
+
+    assert flow.discard(2) and not flow.discard(2)
+    assert len(batch) == 2#the caller's batch isn't changed
+    assert ids(flow.queue) == [1, 3] and flow.queue_length == 2
+
+    assert [message.id_ for message in flow.reset()] == [1, 3]
+    assert flow.in_flight == 0 and flow.queue_length == 0 and flow.ready()
+    assert flow.stats()['dropped'] == 3
@@ -0,0 +1,49 @@
+import json
+
+from utilities_latency import LatencyHistogram, LatencyStats
+from utilities_zmq import ZMQMessage
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert (histogram.percentile(50), histogram.mean) == (None, None)
+    assert histogram.summary()['max'] is None
+
+def test_percentiles_are_within_a_bucket():
+    histogram = LatencyHistogram()
+    for us in range(1, 10001):
+        histogram.record(us / 1e6)
+    assert histogram.count == 10000
+    assert abs(histogram.mean - 5000.5e-6) < 1e-9
+    for percent in (50, 90, 99):
+        exact = percent * 100e-6
+        assert exact <= histogram.percentile(percent) <= exact * 1.04#5 significant bits is about 3%
+    assert histogram.percentile(100) == histogram.max / 1e6 == 0.01
+
+def test_out_of_range_values_are_clamped():
+    histogram = LatencyHistogram(max_seconds=1)
+    histogram.record(-0.5)#clock skew
+    histogram.record(5)
+    assert histogram.percentile(1) == 0
+    assert histogram.percentile(100) == 1
+
+def test_clear():
+    histogram = LatencyHistogram()
+    histogram.record(0.001)
+    histogram.clear()
+    assert histogram.count == 0 and histogram.percentile(50) is None
+
+def test_stats_split_a_call_into_its_parts(tmp_path):
+    stats = LatencyStats()
+    #*server send, client recv, call start, call end, client return, server recv
+    stats.record(ZMQMessage(client='test', function='add', times=[0.0, 0.001, 0.003, 0.013, 0.014, 0.016]))
+    stats.record(ZMQMessage(client='test', function='status', times=[0.0, 0.002]))
+
+    summary = stats.summary(client='test')['test']
+    assert summary['add']['transit']['p50'] == 0.003
+    assert summary['add']['queueing']['p50'] == 0.003
+    assert summary['add']['execution']['p50'] == 0.01
+    assert summary['add']['total']['p50'] == 0.016
+    assert list(summary['status']) == ['transit']
+
+    stats.dump(tmp_path / 'latency.json')
+    assert json.loads((tmp_path / 'latency.json').read_text()) == stats.summary()
@@ -0,0 +1,52 @@
+import inspect
+
+from loguru import logger
+
+import utilities_log
+from utilities_log import trace_message, set_trace_sampling, log_start, TRACE_SAMPLE
+from utilities_zmq import StateMachine, ZMQClient
+
+def traced(sampling: int, messages: int, level='TRACE') -> list:
+    """Traces messages with a sink at level and returns what it got."""
+    received = []
+    logger.remove()
+    logger.add(received.append, level=level, format='{message}')
+    set_trace_sampling(sampling)
+    utilities_log._trace_count = 0
+    try:
+        for index in range(messages):
+            trace_message('sent', index)
+    finally:
+        logger.remove()
+        set_trace_sampling(TRACE_SAMPLE)
+    return [message.strip() for message in received]
+
+def test_sampling():
+    assert traced(1, 5) == ['sent 0', 'sent 1', 'sent 2', 'sent 3', 'sent 4']
+    assert traced(100, 250) == ['sent 99', 'sent 199']
+    assert traced(0, 10) == []
+
+def test_sampling_is_the_default():
+    assert TRACE_SAMPLE > 1
+    for function in (log_start, StateMachine.__init__, ZMQClient.__init__):
+        assert inspect.signature(function).parameters['trace'].default == TRACE_SAMPLE
+
+def test_no_trace_sink_builds_nothing():
+    class Message:
+        built = 0
+        def __str__(self):
+            Message.built += 1
+            return 'message'
+
+    logger.remove()
+    logger.add(lambda message: None, level='DEBUG')
+    set_trace_sampling(1)
+    try:
+        trace_message('sent', Message())
+    finally:
+        logger.remove()
+        set_trace_sampling(TRACE_SAMPLE)
+    assert Message.built == 0
+
+def test_sink_set_up_without_log_start():
+    assert traced(1, 1) == ['sent 0']
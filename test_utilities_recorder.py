@@ -0,0 +1,36 @@
+from utilities_recorder import FlightRecorder, SENT, RECEIVED
+
+def frames_of(index: int) -> list:
+    return [b'client\x00', index.to_bytes(4, 'big') * 10]
+
+def test_read_back(tmp_path):
+    recorder = FlightRecorder(capacity=4096)
+    for index in range(5):
+        recorder.record(SENT if index % 2 else RECEIVED, frames_of(index))
+
+    records = list(FlightRecorder.read(recorder.dump(tmp_path / 'flight.bin')))
+    assert [frames for _, _, frames in records] == [frames_of(index) for index in range(5)]
+    assert [direction for _, direction, _ in records] == [RECEIVED, SENT, RECEIVED, SENT, RECEIVED]
+
+def test_ring_wraps_oldest_first(tmp_path):
+    recorder = FlightRecorder(capacity=1000)
+    for index in range(100):
+        recorder.record(SENT, frames_of(index))
+
+    records = list(FlightRecorder.read(recorder.dump(tmp_path / 'flight.bin')))
+    kept = [int.from_bytes(frames[1][:4], 'big') for _, _, frames in records]
+    assert kept == list(range(100 - len(kept), 100))
+    assert 0 < len(kept) == len(recorder) < 100
+    assert sum(len(frame) for _, _, frames in records for frame in frames) < 1000
+
+def test_long_frames_are_cut(tmp_path):
+    recorder = FlightRecorder(capacity=4096, max_frame_bytes=16)
+    recorder.record(SENT, [b'x' * 100])
+
+    (_, _, frames), = FlightRecorder.read(recorder.dump(tmp_path / 'flight.bin'))
+    assert frames == [b'x' * 16]
+
+def test_record_bigger_than_the_ring_is_skipped():
+    recorder = FlightRecorder(capacity=64, max_frame_bytes=4096)
+    recorder.record(SENT, [b'x' * 100])
+    assert len(recorder) == 0
@@ -0,0 +1,62 @@
+import os
+
+from utilities_recorder import TrafficRecorder, SENT, RECEIVED, index_path
+from utilities_replay import TrafficReader
+
+def frames_of(index: int) -> list:
+    return [b'client\x00', b'header', index.to_bytes(4, 'big') * 8]
+
+def record(path, count=20) -> list:
+    recorder = TrafficRecorder(path)
+    for index in range(count):
+        recorder.record(SENT if index % 2 else RECEIVED, frames_of(index))
+    recorder.close()
+    return [frames_of(index) for index in range(count)]
+
+def read(path) -> list:
+    reader = TrafficReader(path)
+    try:
+        return [[bytes(frame) for frame in frames] for _, _, frames in reader]
+    finally:
+        reader.close()
+
+def test_read_back(tmp_path):
+    path = tmp_path / 'capture.bin'
+    recorded = record(path)
+    assert read(path) == recorded
+
+    reader = TrafficReader(path)
+    assert reader.clients() == ['client']
+    assert reader.index_at(reader.times[5]) == 5
+    assert [direction for _, direction, _ in reader][:2] == [RECEIVED, SENT]
+    reader.close()
+
+def test_capture_cut_off_with_the_whole_index(tmp_path):
+    path = tmp_path / 'capture.bin'
+    recorded = record(path)
+    os.truncate(path, os.path.getsize(path) - 30)
+    assert read(path) == recorded[:-1]
+
+    #*Cut off before the last few records even started
+    os.truncate(path, os.path.getsize(path) - 200)
+    records = read(path)
+    assert 0 < len(records) < len(recorded) - 1
+    assert records == recorded[:len(records)]
+
+def test_index_missing_or_cut_off(tmp_path):
+    path = tmp_path / 'capture.bin'
+    recorded = record(path)
+
+    os.truncate(index_path(path), os.path.getsize(index_path(path)) // 2 + 3)
+    assert read(path) == recorded
+
+    os.remove(index_path(path))
+    assert read(path) == recorded
+
+def test_appending_after_a_cut_off_index_entry(tmp_path):
+    path = tmp_path / 'capture.bin'
+    recorded = record(path, count=5)
+    with open(index_path(path), 'ab') as index:
+        index.write(b'\x00\x01\x02')
+    recorded += record(path, count=5)
+    assert read(path) == recorded
@@ -0,0 +1,108 @@
+import array
+
+import pytest
+
+from utilities_zmq import ZMQMessage, CODECS, get_codec, WorkerPool
+
+def codecs() -> list:
+    """Every codec that can be made here, msgpack is optional."""
+    made = []
+    for name in CODECS:
+        try:
+            made.append(get_codec(name))
+        except ImportError:
+            pass
+    return made
+
+def round_trip(codec, message: ZMQMessage) -> ZMQMessage:
+    return codec.decode(codec.encode(message))
+
+@pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+def test_codec_round_trip(codec):
+    message = ZMQMessage(server='main', client='test', function='add', args=[1, 2.5, 'three', None, [4, {'five': 5}]],
+                         kwargs={'scale': 2}, return_=[True], status='ready', times=[1.5, 2.25], id_=7, dont_log_args=True)
+    received = round_trip(codec, message)
+    assert received.to_dict() == message.to_dict()
+
+@pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+def test_codec_round_trip_of_empty_fields(codec):
+    message = ZMQMessage(function='ping', id_=0)
+    received = round_trip(codec, message)
+    assert received.to_dict() == message.to_dict()
+    assert received.server is None and received.id_ == 0
+    assert round_trip(codec, ZMQMessage(function='ping')).id_ is None
+
+def test_decode_many():
+    codec = get_codec('json')
+    messages = [ZMQMessage(client='test', function='add', args=[index], id_=index) for index in range(3)]
+    frames = [frame for message in messages for frame in codec.encode(message)]
+    assert [message.to_dict() for message in codec.decode_many(frames)] == [message.to_dict() for message in messages]
+
+def test_codec_mismatch_fails():
+    frames = get_codec('json').encode(ZMQMessage(function='add'))
+    with pytest.raises(ValueError):
+        get_codec('pickle').decode(frames)
+
+def test_unknown_codec():
+    with pytest.raises(KeyError):
+        get_codec('xml')
+
+@pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+def test_buffers_go_out_of_band(codec):
+    samples = array.array('d', range(1000))
+    message = ZMQMessage(function='plot', args=[samples, bytearray(b'raw' * 100), memoryview(b'view' * 100)], kwargs={'label': 'x'})
+    frames = codec.encode(message)
+    assert len(frames) > 2#the header, the payload, then the buffers
+    assert len(frames[1]) < samples.itemsize * len(samples)
+
+    received = codec.decode([bytes(frame) for frame in frames])
+    samples_, raw, view = received.args
+    assert samples_ == samples and type(samples_) is array.array
+    assert raw == bytearray(b'raw' * 100)
+    assert bytes(view) == b'view' * 100
+    assert received.kwargs == {'label': 'x'}
+
+@pytest.mark.parametrize('codec', codecs(), ids=lambda codec: codec.name)
+def test_numpy_arrays_go_out_of_band(codec):
+    numpy = pytest.importorskip('numpy')
+    waveform = numpy.arange(12, dtype='float32').reshape(3, 4)
+    frames = codec.encode(ZMQMessage(function='plot', return_=[waveform, waveform[:, 1]]))
+
+    received = codec.decode([bytes(frame) for frame in frames])
+    assert numpy.array_equal(received.return_[0], waveform) and received.return_[0].dtype == waveform.dtype
+    assert numpy.array_equal(received.return_[1], waveform[:, 1])
+
+def test_json_sends_bytes_out_of_band():
+    codec = get_codec('json')
+    frames = codec.encode(ZMQMessage(function='write', args=[b'\x00\xff' * 10]))
+    assert len(frames) == 3
+    assert codec.decode(frames).args == [b'\x00\xff' * 10]
+
+def test_worker_pool_sends_to_the_least_loaded():
+    pool = WorkerPool('fit', ['fit_0', 'fit_1', 'fit_2'])
+    for id_ in range(6):
+        pool.assign(id_, pool.next_worker())
+    assert pool.depth == {'fit_0': 2, 'fit_1': 2, 'fit_2': 2}
+
+    pool.release(1)
+    pool.release(4)
+    assert pool.next_worker() == 'fit_1'
+    pool.release(4)#a reply to a call that was already released changes nothing
+    assert pool.queued == 4
+
+def test_worker_pool_passes_over_dead_workers():
+    pool = WorkerPool('fit', ['fit_0', 'fit_1'])
+    pool.assign(0, 'fit_1')
+    assert pool.next_worker({'fit_0': 'dead', 'fit_1': 'ready'}) == 'fit_1'
+    assert pool.next_worker({'fit_0': 'dead', 'fit_1': 'unresponsive'}) == 'fit_0'#better than nothing
+
+def test_worker_pool_forgets_a_worker():
+    pool = WorkerPool('fit', ['fit_0', 'fit_1'])
+    pool.assign(0, 'fit_0')
+    pool.assign(1, 'fit_1')
+    pool.assign(2, 'fit_0')
+    pool.forget('fit_0')
+    assert pool.depth == {'fit_0': 0, 'fit_1': 1}
+    assert pool.queued == 1
+    pool.release(0)
+    assert pool.depth['fit_0'] == 0
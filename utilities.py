@@ -1,43 +1,89 @@
-from time import time
+from time import time, monotonic, monotonic_ns
+import heapq
 import json
+import numbers
+import statistics
+from collections import deque
 import os
 import csv
+import atexit
+import threading
+from contextlib import contextmanager
 import yaml
 
 class Timer():
+    #*Timers run on time.monotonic_ns, so they don't jump when the wall clock is adjusted. Only segment_by_timeout looks at the wall clock,
+    #*to line the segments up with it (a 60 s timer finishes on the minute), after that it's monotonic too.
+    #*A TimerScheduler can hold them by deadline for loops with lots of timers, see below.
     def __init__(self, timeout, segment_by_timeout=False, start_finished=False):
         if segment_by_timeout and start_finished:
             raise Exception('Cannot segment by timeout and start finished.')
-            
+
+        self.timeout = timeout
+        self._on = True
+        self._scheduler = None
+
+        now = monotonic_ns()
         if start_finished:
-            self.start_time = 0
+            self._start_ns = now - self._timeout_ns
+        elif segment_by_timeout:
+            wall = time()
+            self._start_ns = now - int((wall - (wall // timeout * timeout - timeout))*1e9)
         else:
-            self.start_time = time()
+            self._start_ns = now
+
+    @property
+    def _timeout_ns(self) -> int:
+        return int(self.timeout*1e9)
 
-        if segment_by_timeout:
-            self.start_time = self.start_time // timeout * timeout - timeout
+    @property
+    def start_time(self) -> float:
+        """When the timer started, in time.monotonic() seconds."""
+        return self._start_ns / 1e9
 
-        self.timeout = timeout
-        self.on = True
+    @start_time.setter
+    def start_time(self, value: float):
+        self._start_ns = int(value*1e9)
+        self._rescheduled()
+
+    @property
+    def deadline_ns(self) -> int:
+        """When the timer finishes, in time.monotonic_ns()."""
+        return self._start_ns + self._timeout_ns
 
     @property
     def current_time(self):
-        return time() - self.start_time
-    
+        return (monotonic_ns() - self._start_ns) / 1e9
+
+    @property
+    def remaining(self) -> float:
+        """Seconds until the timer finishes, 0 once it has."""
+        return max(self.deadline_ns - monotonic_ns(), 0) / 1e9
+
     @property
     def running(self):
         if self.on:
-            return self.current_time < self.timeout
+            return monotonic_ns() < self.deadline_ns
         else:
             return False
 
     @property
     def finished(self):
         if self.on:
-            return self.current_time >= self.timeout
+            return monotonic_ns() >= self.deadline_ns
         else:
             return False#the timer hasn't finished if it's off
 
+    @property
+    def on(self) -> bool:
+        return self._on
+
+    @on.setter
+    def on(self, value: bool):
+        self._on = value
+        if value:
+            self._rescheduled()#a scheduler lets go of timers that are off when they come due, this puts it back
+
     @property
     def off(self):
         return not self.on
@@ -47,13 +93,113 @@ class Timer():
         self.on = not value
 
     def reset(self):
-        self.start_time = time()
-        self.on = True
+        self._start_ns = monotonic_ns()
+        self._on = True
+        self._rescheduled()
 
     def next(self):
-        t = time()
-        while self.start_time + self.timeout < t:
-            self.start_time += self.timeout
+        """Moves the start forward by whole timeouts until the timer is running again, keeping it on its original schedule."""
+        now = monotonic_ns()
+        timeout_ns = self._timeout_ns
+        elapsed = now - self._start_ns
+        if timeout_ns <= 0:
+            self._start_ns = now
+        elif elapsed > timeout_ns:
+            self._start_ns += (-(-elapsed // timeout_ns) - 1) * timeout_ns
+        self._rescheduled()
+
+    def _rescheduled(self):
+        if self._scheduler is not None:
+            self._scheduler._push(self)
+
+class TimerScheduler:
+    def __init__(self) -> None:
+        """Timers in a heap by deadline, for loops that hold a lot of them.
+        Checking is one comparison against the earliest deadline no matter how many timers there are, and each timer that finishes costs O(log n).
+        Timers can still be reset, nexted or turned off while they're scheduled, the heap keeps up.
+
+            scheduler = TimerScheduler()
+            scheduler.add(Timer(5), callback=self.check_pressure, repeat=True)
+            ...
+            scheduler.run_due()#in the loop, or wait scheduler.time_until_next() seconds first
+        """
+        self._heap = []#(deadline_ns, sequence, timer)
+        self._sequence = 0
+        self._entries = {}#timer -> (sequence of its current heap entry, callback, repeat)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, timer: Timer):
+        return timer in self._entries
+
+    def add(self, timer: Timer, callback=None, repeat=False) -> Timer:
+        """Schedules timer. When it finishes callback(timer) is called by run_due, or it's returned by expired.
+        A repeating timer is moved on with next() and stays scheduled, otherwise it's removed once it's been handed out.
+        """
+        self._entries[timer] = (None, callback, repeat)
+        timer._scheduler = self
+        self._push(timer)
+        return timer
+
+    def remove(self, timer: Timer):
+        if self._entries.pop(timer, None) is not None:
+            timer._scheduler = None
+
+    def _push(self, timer: Timer):
+        _, callback, repeat = self._entries[timer]
+        self._sequence += 1
+        self._entries[timer] = (self._sequence, callback, repeat)
+        heapq.heappush(self._heap, (timer.deadline_ns, self._sequence, timer))
+
+    def _clean(self):
+        """Drops heap entries for timers that were removed or rescheduled since."""
+        while self._heap:
+            _, sequence, timer = self._heap[0]
+            entry = self._entries.get(timer)
+            if entry is not None and entry[0] == sequence:
+                return
+            heapq.heappop(self._heap)
+
+    def time_until_next(self) -> float:
+        """Seconds until the next timer finishes, 0 if one already has, None if there aren't any."""
+        self._clean()
+        if self._heap:
+            return max(self._heap[0][0] - monotonic_ns(), 0) / 1e9
+
+    def expired(self):
+        """Yields every timer that has finished, earliest first. Timers that are off are skipped and stay scheduled."""
+        for timer, _ in self._due():
+            yield timer
+
+    def run_due(self) -> int:
+        """Calls the callback of every timer that has finished. Returns how many finished."""
+        count = 0
+        for timer, callback in self._due():
+            if callback is not None:
+                callback(timer)
+            count += 1
+        return count
+
+    def _due(self):
+        now = monotonic_ns()
+        last = self._sequence#repeating timers pushed back in while this runs wait for the next call, even ones with a timeout of 0
+        while True:
+            self._clean()
+            if not self._heap or self._heap[0][0] > now or self._heap[0][1] > last:
+                return
+
+            _, _, timer = heapq.heappop(self._heap)
+            _, callback, repeat = self._entries[timer]
+            if timer.off:
+                self._entries[timer] = (None, callback, repeat)#pushed again when it's reset or turned back on
+                continue
+
+            if repeat:
+                timer.next()
+            else:
+                self.remove(timer)
+            yield timer, callback
 
 class Spinner:
     def __init__(self):
@@ -93,36 +239,266 @@ def load_config(file_path):
 
     return config
 
-class RollingList:
-    def __init__(self, initial_list=None, length=100) -> None:
-        """A rolling list that always contains the most recent "length" components.
-        Used generally for keeping track of recent values for redundant fault checking, or for graphing.
+def write_atomically(path, data, fsync=False):
+    """Writes to a temporary file next to path then renames it over path, which is atomic, so readers see the old file or the new one, never half.
 
-        Args:
-            initial_list (list, optional): Defaults to [].
-            length (int, optional): Always is this length or less. Defaults to 100.
-        """
-        self._list = [] if initial_list is None else initial_list
-        self.length = length
+    Args:
+        path (str or Path): The file to write, its folder is made if it doesn't exist.
+        data (str, bytes or iterable of bytes): What to write, pieces of bytes are written one after another.
+        fsync (bool, optional): Also wait for it to reach the disk before renaming, so a power cut can't leave it empty. Defaults to False.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w' if isinstance(data, str) else 'wb') as file:
+        if isinstance(data, (str, bytes, bytearray, memoryview)):
+            file.write(data)
+        else:
+            for piece in data:
+                file.write(piece)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temporary_path, path)
 
-    def __str__(self) -> str:
-        return str(self._list)
+_REALS = (int, float, bool)
+_INF = float('inf')
+_NAN = float('nan')
+
+def _finite(element) -> bool:
+    """False for NaN and infinities, whatever type of real they are."""
+    return -_INF < element < _INF
+
+class _Largest:
+    """Orders the opposite way to what it holds, so the heap of (-count, _Largest(element)) has the largest of the most common elements on top."""
+    __slots__ = ('element',)
+
+    def __init__(self, element) -> None:
+        self.element = element
+
+    def __lt__(self, other) -> bool:
+        return other.element < self.element
+
+class _RollingAggregates:
+    #*The checks of RollingList and TimedRollingList, which don't scan the elements.
+    #*Every element added goes into a set of running aggregates and is taken away again when it's pushed out, oldest first:
+    #*  _minimums, _maximums   monotonic deques of (sequence, element), the front is the min/max   all_less_than, all_greater_than, within, min, max
+    #*  _mean, _m2             Welford's running mean and sum of squared differences              mean, variance, std
+    #*  _truthy, _empty        how many elements are truthy and how many have a length of 0       all_true, all_false, all_empty, all_non_empty
+    #*  _counts, _heap         how many of each element there are, and a heap of the counts       majority
+    #*  _non_finite            how many elements are NaN or infinite
+    #*So every check is O(1), apart from majority which is O(log n) from the heap. The heap is only kept once majority has been called.
+    #*An aggregate an element can't go in (a string in with numbers has no mean, a list can't be counted) is set to None and
+    #*those checks scan the elements like they used to. NaN compares False with everything, so it would push the real min and max
+    #*out of the deques, and inf - inf is NaN, so neither goes in the deques or the running sums. While there are any,
+    #*the checks that use those scan instead, and min and max are NaN if there's a NaN. Subclasses call _refresh every time about as many elements have been pushed out
+    #*as there are, then those are worked out again from scratch, which brings them back once the element has gone,
+    #*and the running sums are summed again so float rounding doesn't build up. That's O(n) every n appends, so O(1) amortized too.
+    #*Subclasses iterate oldest first and keep _count, full and _appended, the sequence number of the next element.
+    def _expire(self):
+        """Called before every check, for subclasses that push elements out on something other than appending."""
+
+    def _refresh(self):
+        """See the top of the class. RollingList calls it every time its ring wraps."""
+        if None in (self._minimums, self._numbers, self._truthy, self._empty, self._counts):
+            self._rebuild()
+            return
+
+        if self._numbers:
+            self._resum(self.to_list())
+        if self._heap is not None:
+            self._heap = None
+            self._majority_heap()
+
+    def _rebuild(self):
+        self._minimums = deque()
+        self._maximums = deque()
+        self._numbers = 0
+        self._sum = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._m2_peak = 0.0
+        self._non_finite = 0
+        self._truthy = 0
+        self._empty = 0
+        self._counts = {}
+        heap, self._heap = self._heap, None
+
+        first = self._appended - self._count
+        for offset, element in enumerate(self):
+            self._add(first + offset, element)
+
+        #*The heap is only kept once majority has been asked for
+        if heap is not None and self._counts is not None:
+            self._majority_heap()
+
+    def _heapify(self):
+        self._heap = [(-count, _Largest(element)) for element, count in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def _add(self, sequence: int, element):
+        real = type(element) in _REALS or isinstance(element, numbers.Real)
+        finite = not real or -_INF < element < _INF
+        if not finite:
+            self._non_finite += 1
+
+        elif self._minimums is not None:
+            try:
+                while self._minimums and not self._minimums[-1][1] < element:
+                    self._minimums.pop()
+                self._minimums.append((sequence, element))
+                while self._maximums and not element < self._maximums[-1][1]:
+                    self._maximums.pop()
+                self._maximums.append((sequence, element))
+            except TypeError:
+                self._minimums = self._maximums = None
+
+        if self._numbers is not None:
+            if not real:
+                self._numbers = None
+            elif finite:
+                self._numbers += 1
+                self._sum += element
+                difference = element - self._mean
+                self._mean += difference/self._numbers
+                self._m2 += difference*(element - self._mean)
+                self._m2_peak = max(self._m2_peak, self._m2)
+
+        if self._truthy is not None:
+            try:
+                if element:
+                    self._truthy += 1
+            except (TypeError, ValueError):#NumPy arrays have no truth value
+                self._truthy = None
+
+        if self._empty is not None:
+            try:
+                if len(element) == 0:
+                    self._empty += 1
+            except TypeError:
+                self._empty = None
+
+        if self._counts is not None:
+            try:
+                count = self._counts[element] = self._counts.get(element, 0) + 1
+            except TypeError:
+                self._counts = self._heap = None
+            else:
+                self._push_count(element, count)
+
+    def _remove(self, sequence: int, element):
+        if self._non_finite and (type(element) in _REALS or isinstance(element, numbers.Real)) and not _finite(element):
+            self._non_finite -= 1
+
+        elif self._minimums is not None:
+            if self._minimums[0][0] == sequence:
+                self._minimums.popleft()
+            if self._maximums[0][0] == sequence:
+                self._maximums.popleft()
+
+        if self._numbers is not None and -_INF < element < _INF:
+            self._numbers -= 1
+            self._sum -= element
+            if self._numbers:
+                difference = element - self._mean
+                self._mean -= difference/self._numbers
+                self._m2 -= difference*(element - self._mean)
+                #*Taking a huge outlier back out leaves only rounding error, so the rest are summed again. Squares of finite
+                #*values over about 1e154 overflow, and inf - inf is NaN, so the sums are redone while either isn't finite too.
+                if self._m2 < self._m2_peak*1e-8 or not (_finite(self._m2) and _finite(self._sum)):
+                    self._resum(self.to_list()[1:])#everything but the oldest, which is the one going
+            else:
+                self._mean = self._m2 = 0.0
+
+        if self._truthy is not None and element:
+            self._truthy -= 1
+
+        if self._empty is not None and len(element) == 0:
+            self._empty -= 1
+
+        if self._counts is not None:
+            count = self._counts[element] - 1
+            if count:
+                self._counts[element] = count
+                self._push_count(element, count)
+            else:
+                del self._counts[element]
+
+    def _push_count(self, element, count: int):
+        if self._heap is not None:
+            try:
+                heapq.heappush(self._heap, (-count, _Largest(element)))
+            except TypeError:#elements that can't be ordered, majority tries the heap again next time it's called
+                self._heap = None
+
+    def _resum(self, elements: list):
+        """Works the running sums out again from elements."""
+        elements = [element for element in elements if _finite(element)]
+        self._numbers = len(elements)
+        self._sum = sum(elements)
+        self._mean = statistics.fmean(elements) if elements else 0.0
+        self._m2 = sum((element - self._mean)*(element - self._mean) for element in elements)#** raises on overflow, * gives inf
+        self._m2_peak = self._m2
 
     @property
-    def last_value(self):
-        """Returns the last value in the list.
-        """
-        return self._list[-1]
+    def min(self):
+        """The smallest element, None if it's empty."""
+        self._expire()
+        if not self._count:
+            return None
+        elif self._non_finite:
+            return self._nan_or(min)
+        return self._minimums[0][1] if self._minimums is not None else min(self)
 
-    def append(self, element):
-        """Call List.append then removes the oldest element if it's over the self.length
+    @property
+    def max(self):
+        """The largest element, None if it's empty."""
+        self._expire()
+        if not self._count:
+            return None
+        elif self._non_finite:
+            return self._nan_or(max)
+        return self._maximums[0][1] if self._maximums is not None else max(self)
 
-        Args:
-            element (_type_): The list element to add
-        """
-        self._list.append(element)
-        if len(self._list) > self.length:
-            self._list.pop(0)
+    def _nan_or(self, function):
+        """min or max by scanning, NaN if there's a NaN, which min and max would otherwise skip or not depending on where it is."""
+        return _NAN if any(element != element for element in self) else function(self)
+
+    @property
+    def sum(self):
+        self._expire()
+        return self._sum if self._numbers is not None and not self._non_finite else sum(self)
+
+    @property
+    def mean(self) -> float:
+        """None if it's empty."""
+        self._expire()
+        if not self._count:
+            return None
+        if self._numbers is None:
+            return statistics.fmean(self)
+        elif self._non_finite:
+            return sum(self)/self._count#fmean won't add inf and -inf
+        return self._mean
+
+    @property
+    def variance(self) -> float:
+        """The population variance, None if it's empty."""
+        self._expire()
+        if not self._count:
+            return None
+        if self._numbers is None:
+            return statistics.pvariance(self)
+        elif self._non_finite:
+            return _NAN
+        return max(self._m2/self._numbers, 0.0)
+
+    @property
+    def std(self) -> float:
+        """The population standard deviation, None if it's empty."""
+        variance = self.variance
+        return None if variance is None else variance**0.5
 
     def all_less_than(self, value) -> bool:
         """Returns True if all values are less than value
@@ -131,12 +507,15 @@ class RollingList:
             value (any): value to compare to
 
         Returns:
-            bool: all(element < value for element in self._list)
+            bool: all(element < value for element in self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._maximums and not self._non_finite:
+            return self._maximums[0][1] < value
         else:
-            return all(element < value for element in self._list)
+            return all(element < value for element in self)
 
     def all_greater_than(self, value) -> bool:
         """Returns True if all values are greater than value
@@ -145,72 +524,106 @@ class RollingList:
             value (any): value to compare to
 
         Returns:
-            bool: all(element > value for element in self._list)
+            bool: all(element > value for element in self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._minimums and not self._non_finite:
+            return self._minimums[0][1] > value
         else:
-            return all(element > value for element in self._list)
+            return all(element > value for element in self)
 
     def all_empty(self) -> bool:
         """Returns True if all elements in the list have a length equal to 0
 
         Returns:
-            bool: all(len(element) == 0 for element in self._list)
+            bool: all(len(element) == 0 for element in self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._empty is not None:
+            return self._empty == self._count
         else:
-            return all(len(element) == 0 for element in self._list)
+            return all(len(element) == 0 for element in self)
 
     def all_non_empty(self) -> bool:
         """Returns True if all elements in the list have a length greater than 0
 
         Returns:
-            bool: all(len(element) > 0 for element in self._list)
+            bool: all(len(element) > 0 for element in self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._empty is not None:
+            return self._empty == 0
         else:
-            return all(len(element) > 0 for element in self._list)
+            return all(len(element) > 0 for element in self)
 
     def all_true(self) -> bool:
         """returns True if all elements are True
 
         Returns:
-            bool: all(self._list)
+            bool: all(self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._truthy is not None:
+            return self._truthy == self._count
         else:
-            return all(self._list)
+            return all(self)
 
     def all_false(self) -> bool:
         """return False if all elements are False
 
         Returns:
-            bool: any(self._list)
+            bool: any(self)
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._truthy is not None:
+            return self._truthy == 0
         else:
-            return not any(self._list)
+            return not any(self)
 
     def majority(self):
-        """Returns the element that occurs most frequently
+        """Returns the element that occurs most frequently, the largest of them if it's a tie
 
         Returns:
             any: the element that occurs most frequently
         """
-        if len(self._list) < self.length:
+        self._expire()
+        if not self.full:
             return None
+        elif self._counts and self._majority_heap():
+            #*Counts that have changed since they were pushed are left in the heap and skipped here
+            while -self._heap[0][0] != self._counts.get(self._heap[0][1].element):
+                heapq.heappop(self._heap)
+            if len(self._heap) > 2*len(self._counts) + 16:
+                self._heapify()
+            return self._heap[0][1].element
         else:
-            unique_elements = list(set(self._list))
-            majority_list = [(self._list.count(element), element) for element in unique_elements]
+            elements = self.to_list()
+            unique_elements = list(set(elements))
+            majority_list = [(elements.count(element), element) for element in unique_elements]
             majority_list.sort()
             majority = majority_list[-1][1]
             return majority
 
+    def _majority_heap(self) -> bool:
+        """Starts keeping the heap the first time majority is called. False if the elements can't be ordered."""
+        if self._heap is None:
+            try:
+                self._heapify()
+            except TypeError:
+                self._heap = None
+                return False
+        return True
+
     def within(self, limit: float) -> bool:
         """Checks if the difference between the max and min is within the limit.
 
@@ -220,11 +633,422 @@ class RollingList:
         Returns:
             bool: True if the difference is between the limit.
         """
-        range_ = max(self._list) - min(self._list)
+        self._expire()
+        range_ = self.max - self.min if self._minimums or self._non_finite else max(self) - min(self)
         return limit > range_
 
+class RollingList(_RollingAggregates):
+    #*The elements are kept in a preallocated list used as a ring. _start is the oldest element, once it's full an append overwrites it
+    #*and moves _start on, so appending, last_value and indexing are all O(1) however long it is.
+    #*The checks are in _RollingAggregates.
+    def __init__(self, initial_list=None, length=100) -> None:
+        """A rolling list that always contains the most recent "length" components.
+        Used generally for keeping track of recent values for redundant fault checking, or for graphing.
+
+        Args:
+            initial_list (list, optional): Defaults to []. Only the last length elements are kept.
+            length (int, optional): Always is this length or less. Defaults to 100.
+        """
+        self._length = length
+        self.clear()
+        for element in [] if initial_list is None else initial_list:
+            self.append(element)
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    @length.setter
+    def length(self, length: int):
+        """Keeps the most recent elements that fit."""
+        elements = self.to_list()[-length:] if length else []
+        self._length = length
+        self.clear()
+        for element in elements:
+            self.append(element)
+
+    def clear(self):
+        self._buffer = [None]*self._length
+        self._start = 0
+        self._count = 0
+        self._appended = 0#sequence number of the next element
+        self._heap = None
+        self._rebuild()
+
+    def __str__(self) -> str:
+        return str(self.to_list())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int):
+        """Oldest first like a list, so [-1] is the newest."""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('RollingList index out of range')
+        return self._buffer[(self._start + index) % self._length]
+
+    def __iter__(self):
+        """Oldest first."""
+        end = self._start + self._count
+        if end <= self._length:
+            yield from self._buffer[self._start:end]
+        else:
+            yield from self._buffer[self._start:]
+            yield from self._buffer[:end - self._length]
+
+    def to_list(self) -> list:
+        """A copy of the elements, oldest first."""
+        return list(self)
+
+    @property
+    def full(self) -> bool:
+        return self._count >= self._length
+
+    @property
+    def last_value(self):
+        """Returns the last value in the list.
+        """
+        if not self._count:
+            raise IndexError('RollingList is empty')
+        return self._buffer[(self._start + self._count - 1) % self._length]
+
+    def append(self, element):
+        """Adds element, overwriting the oldest element once there are self.length of them
+
+        Args:
+            element (_type_): The list element to add
+        """
+        if self._count < self._length:
+            self._buffer[(self._start + self._count) % self._length] = element
+            self._count += 1
+            self._add(self._appended, element)
+            self._appended += 1
+        elif self._length:
+            self._remove(self._appended - self._length, self._buffer[self._start])
+            self._buffer[self._start] = element
+            self._add(self._appended, element)
+            self._appended += 1
+            self._start += 1
+            if self._start == self._length:
+                self._start = 0
+                self._refresh()
+
+class _Tier:
+    """min, max, mean buckets of one resolution, for TimedRollingList.history."""
+    def __init__(self, resolution: float, keep: float) -> None:
+        self.resolution = resolution
+        self.keep = keep
+        self.buckets = deque()#[start, min, max, sum, count]
+
+    def add(self, timestamp: float, value):
+        start = timestamp // self.resolution * self.resolution
+        if self.buckets and start <= self.buckets[-1][0]:#late samples go in the newest bucket
+            bucket = self.buckets[-1]
+            if value < bucket[1]:
+                bucket[1] = value
+            if value > bucket[2]:
+                bucket[2] = value
+            bucket[3] += value
+            bucket[4] += 1
+        else:
+            self.buckets.append([start, value, value, value, 1])
+            self.expire(timestamp)
+
+    def expire(self, now: float):
+        while self.buckets and self.buckets[0][0] + self.resolution < now - self.keep:
+            self.buckets.popleft()
+
+class TimedRollingList(_RollingAggregates):
+    #*RollingList over a time span instead of a count, for alarms like "above threshold for 5 s" when samples come at irregular rates.
+    #*Samples are (timestamp, value) in two deques, and anything older than span is pushed out every time it's appended to or checked.
+    #*The checks are the same as RollingList's and just as cheap, see _RollingAggregates. Like RollingList they're None until
+    #*there's a full window: samples have been coming since at least span ago without a gap that emptied it, so stale data isn't a pass.
+    #*It also keeps tiers of min, max and mean buckets of numeric values, 1 s buckets for an hour and 1 min buckets for a day by default,
+    #*so hours of history can be graphed from history() without keeping every sample.
+    def __init__(self, span: float, tiers=((1, 3600), (60, 86400)), clock=monotonic) -> None:
+        """A rolling list of the samples in the last span seconds.
+
+        Args:
+            span (float): Seconds of samples to keep and check
+            tiers (tuple, optional): (resolution, keep) seconds of each downsampled tier. Defaults to ((1, 3600), (60, 86400)).
+            clock (Callable, optional): What timestamps are measured with, appends without one are stamped with it. Defaults to time.monotonic.
+        """
+        self.span = span
+        self.clock = clock
+        self._tiers = [_Tier(resolution, keep) for resolution, keep in sorted(tiers)]
+        self.clear()
+
+    def clear(self):
+        self._times = deque()
+        self._values = deque()
+        self._appended = 0
+        self._removed = 0#since the last _refresh
+        self._first = None#timestamp of the first sample
+        self._heap = None
+        self._rebuild()
+        for tier in self._tiers:
+            tier.buckets.clear()
+
+    @property
+    def _count(self) -> int:
+        return len(self._values)
+
+    def __str__(self) -> str:
+        self._expire()
+        return str(self.to_list())
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._values)
+
+    def __iter__(self):
+        """The values, oldest first. Iterating and to_list don't push old samples out first, len does."""
+        return iter(self._values)
+
+    def to_list(self) -> list:
+        return list(self._values)
+
+    def samples(self) -> list:
+        """(timestamp, value) of every sample in the span, oldest first."""
+        self._expire()
+        return list(zip(self._times, self._values))
+
+    @property
+    def full(self) -> bool:
+        self._expire()
+        return bool(self._values) and self.clock() - self._first >= self.span
+
+    @property
+    def last_value(self):
+        """Returns the newest value that's still in the span.
+        """
+        self._expire()
+        if not self._values:
+            raise IndexError('TimedRollingList is empty')
+        return self._values[-1]
+
+    def append(self, value, timestamp:float=None):
+        """Adds value, stamped with clock() unless it's given a timestamp from the same clock."""
+        if timestamp is None:
+            timestamp = self.clock()
+        if self._first is None:
+            self._first = timestamp
+
+        self._times.append(timestamp)
+        self._values.append(value)
+        self._add(self._appended, value)
+        self._appended += 1
+
+        if type(value) in _REALS or isinstance(value, numbers.Real):
+            for tier in self._tiers:
+                tier.add(timestamp, value)
+
+        self._push_out(timestamp - self.span)
+
+    def _expire(self):
+        self._push_out(self.clock() - self.span)
+
+    def _push_out(self, oldest: float):
+        """Removes samples from before oldest."""
+        while self._times and self._times[0] < oldest:
+            self._remove(self._appended - len(self._values), self._values[0])
+            self._times.popleft()
+            self._values.popleft()
+            self._removed += 1
+        if not self._values:
+            self._first = None#the window starts again from the next sample
+
+        if self._removed and self._removed >= len(self._values):
+            self._removed = 0
+            self._refresh()
+
+    def history(self, resolution:float=None) -> list:
+        """Downsampled history for graphing, from the finest tier at least resolution seconds a bucket (the finest of all with None).
+
+        Returns:
+            list: (start, min, max, mean) of every bucket, oldest first
+        """
+        tiers = [tier for tier in self._tiers if resolution is None or tier.resolution >= resolution] or self._tiers[-1:]
+        if not tiers:
+            return []
+        tier = tiers[0]
+        tier.expire(self.clock())
+        return [(start, minimum, maximum, total/count) for start, minimum, maximum, total, count in tier.buckets]
+
+class RollingArray:
+    #*RollingList for numbers, in a NumPy array. A sample is 8 bytes of float64 (or whatever dtype) instead of a Python object in a list.
+    #*The array is a ring of length samples, so appending is one write and a float64 sample is 8 bytes. values is an ordered view
+    #*for graphing that every check and statistic works on in a single vectorized call. Once the ring has wrapped the oldest
+    #*sample is part way along, so the first read after appending rotates the array in place to put it back at the start.
+    #*That's one O(length) copy per read after appends, not per append, and reads in between are views that don't copy.
+    #*With channels it's 2-D, one column per channel, and the checks and statistics give an array with one answer per channel.
+    #*NumPy is only imported when one is made, so it isn't needed for anything else in this file.
+    def __init__(self, length=1000, channels:int=None, dtype='float64', initial=None) -> None:
+        """A rolling window of the most recent length samples.
+
+        Args:
+            length (int, optional): How many samples to keep. Defaults to 1000.
+            channels (int, optional): Samples are rows of this many values, None makes them single values. Defaults to None.
+            dtype (str, optional): NumPy dtype of the values. Defaults to 'float64'.
+            initial (array like, optional): Samples to start with. Defaults to None.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('RollingArray needs numpy. pip install numpy') from None
+
+        self.length = length
+        self.channels = channels
+        self._buffer = numpy.zeros((length,) if channels is None else (length, channels), dtype=dtype)
+        self._head = 0#where the next sample goes
+        self._count = 0
+        if initial is not None:
+            self.extend(initial)
+
+    def __str__(self) -> str:
+        return str(self.values)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    @property
+    def full(self) -> bool:
+        return self._count >= self.length
+
+    @property
+    def values(self):
+        """The samples oldest first, a read only view. It changes as samples are added, copy it to keep it."""
+        import numpy
+        start = (self._head - self._count) % self.length if self.length else 0
+        if start + self._count > self.length:#wrapped, see the top of the class
+            self._buffer[:] = numpy.roll(self._buffer, -start, axis=0)
+            start = 0
+            self._head = self._count % self.length
+        view = self._buffer[start:start+self._count]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def last_value(self):
+        if not self._count:
+            raise IndexError('RollingArray is empty')
+        return self._buffer[self._head - 1]#-1 is the end of the ring when the head has just wrapped
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def append(self, sample):
+        """Adds a value, or a row of channels values."""
+        if not self.length:
+            return
+        self._buffer[self._head] = sample
+        self._head += 1
+        if self._head == self.length:
+            self._head = 0
+        self._count = min(self._count + 1, self.length)
+
+    def extend(self, samples):
+        """Adds many samples at once, an array of values or of rows. Only the last length of them are kept if there are more."""
+        import numpy
+        samples = numpy.asarray(samples, dtype=self._buffer.dtype)
+        if not self.length or not len(samples):
+            return
+        samples = samples[-self.length:]
+        count = len(samples)
+
+        #*In at most two pieces, up to the end of the ring then from its start
+        first = min(count, self.length - self._head)
+        self._buffer[self._head:self._head+first] = samples[:first]
+        self._buffer[:count-first] = samples[first:]
+        self._head = (self._head + count) % self.length
+        self._count = min(self._count + count, self.length)
+
+    def _check(self, result):
+        """None until it's full like RollingList, a bool for one channel or an array of them for more."""
+        if not self.full:
+            return None
+        return bool(result) if self.channels is None else result
+
+    def all_less_than(self, value):
+        """value can be one for every channel or an array with one for each."""
+        return self._check((self.values < value).all(axis=0))
+
+    def all_greater_than(self, value):
+        return self._check((self.values > value).all(axis=0))
+
+    def all_true(self):
+        """All non zero."""
+        return self._check(self.values.all(axis=0))
+
+    def all_false(self):
+        """All zero."""
+        return self._check(~self.values.any(axis=0))
+
+    def within(self, limit):
+        """The difference between the max and min is less than limit."""
+        import numpy
+        if not self._count:
+            return None
+        result = numpy.ptp(self.values, axis=0) < limit
+        return bool(result) if self.channels is None else result
+
+    def majority(self):
+        """The most common value, the largest of them if it's a tie like RollingList. One for each channel with channels."""
+        import numpy
+        if not self.full:
+            return None
+        columns = [self.values] if self.channels is None else self.values.T
+        majorities = []
+        for column in columns:
+            unique, counts = numpy.unique(column, return_counts=True)
+            majorities.append(unique[len(counts) - 1 - counts[::-1].argmax()])#unique is sorted, so the last of the most common is the largest
+        return majorities[0] if self.channels is None else numpy.array(majorities)
+
+    def _statistic(self, function):
+        if not self._count:
+            return None
+        return function(self.values, axis=0)
+
+    @property
+    def min(self):
+        import numpy
+        return self._statistic(numpy.min)
+
+    @property
+    def max(self):
+        import numpy
+        return self._statistic(numpy.max)
+
+    @property
+    def mean(self):
+        import numpy
+        return self._statistic(numpy.mean)
+
+    @property
+    def std(self):
+        """The population standard deviation like RollingList.std."""
+        import numpy
+        return self._statistic(numpy.std)
+
 class _Settings:
+    #*The settings are served from memory. Assigning one only changes it in memory, marks it changed and starts a flush timer,
+    #*the file is written flush_delay seconds later with everything that changed in the meantime, in one write.
+    #*with settings.batch(): holds the writes back until the block ends and writes them together, or puts the old values back if it raises.
+    #*Writes go to a temporary file that's then renamed over settings.json, so a crash part way through leaves the old file, never half of one.
+    #*A flush reads the file first and only replaces the keys this process changed, so another process's changes to other keys are kept.
+    #*Anything still waiting is flushed when the process exits, call flush() to write it sooner.
     def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._changed = set()#keys changed since the last flush
+        self._flush_timer = None
+        self._batch_depth = 0
+
         #*Make a dictionary of all the settings names. These will be the keys and default values of the json dictionary
         self._class_dict = {}
         for key, value in self.__dict__.items():
@@ -240,8 +1064,7 @@ class _Settings:
                 os.mkdir(os.path.dirname(self._path))#so try to make it
             except FileExistsError:#this failing I think means it's empty
                 pass
-            with open(self._path, 'w') as file:#regardless, write the class dictionary to the json
-                json.dump(self._class_dict, file, indent=4)
+            self._write(self._class_dict)#regardless, write the class dictionary to the json
         else:#check that the keys still match after loading
             rewrite = False
             for key in self._class_dict:
@@ -263,40 +1086,117 @@ class _Settings:
             assert self._class_dict == json_dict#they should be fully synced now
 
             if rewrite:#rewrite the actual json if necessary
-                with open(self._path, 'w') as file:#regardless, write the class dictionary to the json
-                    json.dump(self._class_dict, file, indent=4)
+                self._write(self._class_dict)
 
             for key in self._class_dict:#now sync the _class_dict and the class dictinary (the actual values associated with the instance name i.e. settings.x)
                 self.__dict__[key] = self._class_dict[key]
 
-    def __setattr__(self, _k: str, _v) -> None:
-        #*Change the value in the instance of the object
-        super().__setattr__(_k, _v)
+        atexit.register(self.flush)
 
-        #*If it's been initialized and it's not _path or _settings_dict set the json
-        if self._initialized and not _k.startswith('_'):
+    def __setattr__(self, _k: str, _v) -> None:
+        #*If it's been initialized and it's not _path or _settings_dict check it's a setting that can be set
+        setting = not _k.startswith('_') and self._initialized
+        if setting:
             if self._readonly:
                 raise Exception('Trying to assign to a readonly setting.')
             if _k not in self._class_dict:
                 raise KeyError('Invalid key. Key not in original settings.')
-            else:
-                with open(self._path, 'r') as file:#pull up the dictionary
-                    json_dict = json.load(file)
-                json_dict[_k] = _v#change the appropriate entry
-                with open(self._path, 'w') as file:#put it back
-                    json.dump(json_dict, file, indent=4)
+
+        #*Change the value in the instance of the object
+        super().__setattr__(_k, _v)
+
+        #*Then in the cache, and schedule it to be written
+        if setting:
+            with self._lock:
+                self._class_dict[_k] = _v
+                self._changed.add(_k)
+            if not self._batch_depth:
+                self._schedule_flush()
 
     def __str__(self) -> str:
-        with open(self._path, 'r') as file:
-            _settings = json.load(file)
-        return _settings.__str__()
+        return self._class_dict.__str__()
+
+    @contextmanager
+    def batch(self):
+        """Changes made in the block are written together when it ends. If it raises they're all undone instead.
+
+        with settings.batch():
+            settings.ramp_time = 5
+            settings.alarm_wait = 30
+        """
+        if self._batch_depth == 0:
+            before = dict(self._class_dict), set(self._changed)
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                values, changed = before
+                with self._lock:
+                    self._class_dict.update(values)
+                    self._changed = changed
+                self.__dict__.update(values)
+            raise
+        else:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    def _schedule_flush(self):
+        if not self._flush_delay:
+            self.flush()
+            return
+
+        with self._lock:
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self._flush_delay, self._timed_flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _timed_flush(self):
+        if self._batch_depth:#the batch writes everything when it ends
+            with self._lock:
+                self._flush_timer = None
+        else:
+            self.flush()
+
+    def flush(self):
+        """Writes the settings changed since the last flush now, instead of waiting for the flush timer."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._changed:
+                return
+
+            try:
+                with open(self._path, 'r') as file:#pull up the dictionary so other processes' changes aren't lost
+                    json_dict = json.load(file)
+            except Exception:
+                json_dict = dict(self._class_dict)
+            for key in self._changed:#change the appropriate entries
+                json_dict[key] = self._class_dict[key]
+            self._changed = set()
+            self._write(json_dict)
+
+    def _write(self, json_dict: dict):
+        """Writes a temporary file then renames it over the settings, which is atomic, so the file is always either old or new."""
+        write_atomically(self._path, json.dumps(json_dict, indent=4), fsync=True)
 
 class Settings(_Settings):
-    def __init__(self, readonly=False):
+    def __init__(self, readonly=False, flush_delay=0.5):
+        """
+        Args:
+            readonly (bool, optional): Assigning a setting raises. Defaults to False.
+            flush_delay (float, optional): Seconds from a setting changing until it's written, changes in that time are written together.
+                0 writes every change straight away. Defaults to 0.5.
+        """
         #*This is where the json will be stored
         self._initialized = False
         self._path = 'settings/settings.json'
         self._readonly = readonly
+        self._flush_delay = flush_delay
 
         #*These are the default values for json dictionary entries. It won't let anymore be set besides these, and they'll show up in linting.
         self.send_list = ['6366145540@text2email.net']
@@ -0,0 +1,185 @@
+#*Payload compression for ZMQ messages.
+#*Only the payload frame (args, kwargs and return_ after the codec) is compressed, and only when it's at least threshold bytes,
+#*small messages aren't worth the CPU. If compressing doesn't make it smaller it's sent as it was.
+#*Out-of-band buffers (arrays, bytes) are never compressed, they'd need a copy and are mostly incompressible waveforms anyway.
+#*Which compressor was used goes in the message header flags, so whoever receives it decompresses without being told,
+#*and a server and its clients can each compress (or not) however they like.
+#*  zlib  stdlib, a good default for text and JSON
+#*  lzma  stdlib, smaller but many times slower, for big payloads over slow links
+#*  zstd  needs zstandard, about as small as zlib and several times faster
+#*  lz4   needs lz4, the fastest, for when CPU matters more than bytes
+#*CompressionStats keeps the ratio and how long compressing and decompressing took, see ZMQServer.compression_stats.
+
+import time
+import zlib
+import lzma
+
+try:
+    import zstandard
+except ImportError:#zstandard is optional, zlib and lzma are always there
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:#lz4 is optional too
+    lz4 = None
+
+class CompressionStats:
+    def __init__(self) -> None:
+        self.compressed = 0#payloads sent compressed
+        self.skipped = 0#payloads over the threshold that didn't get any smaller
+        self.bytes_in = 0#size of the compressed payloads before compressing
+        self.bytes_out = 0#and after
+        self.compress_seconds = 0
+        self.decompressed = 0
+        self.decompress_seconds = 0
+
+    @property
+    def ratio(self) -> float:
+        """Original size over compressed size of everything compressed, 0 if nothing has been."""
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0
+
+    def stats(self) -> dict:
+        return {
+            'compressed': self.compressed,
+            'skipped': self.skipped,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.ratio,
+            'compress_seconds': self.compress_seconds,
+            'compress_us_per_message': 1e6*self.compress_seconds/self.compressed if self.compressed else 0,
+            'decompressed': self.decompressed,
+            'decompress_seconds': self.decompress_seconds,
+            'decompress_us_per_message': 1e6*self.decompress_seconds/self.decompressed if self.decompressed else 0,
+        }
+
+class _Compressor:
+    name = None
+    compressor_id = None#0 is uncompressed, ids have to fit in the 3 header flag bits
+
+    def __init__(self, level:int=None) -> None:
+        self.level = level
+
+    def compress(self, data) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data) -> bytes:
+        raise NotImplementedError
+
+class ZlibCompressor(_Compressor):
+    name = 'zlib'
+    compressor_id = 1
+
+    def compress(self, data) -> bytes:
+        return zlib.compress(data, 1 if self.level is None else self.level)
+
+    def decompress(self, data) -> bytes:
+        return zlib.decompress(data)
+
+class LzmaCompressor(_Compressor):
+    name = 'lzma'
+    compressor_id = 2
+
+    def compress(self, data) -> bytes:
+        return lzma.compress(data, preset=0 if self.level is None else self.level)
+
+    def decompress(self, data) -> bytes:
+        return lzma.decompress(data)
+
+class ZstdCompressor(_Compressor):
+    name = 'zstd'
+    compressor_id = 3
+
+    def __init__(self, level:int=None) -> None:
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package. pip install zstandard')
+        super().__init__(level)
+        self._compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data) -> bytes:
+        return self._decompressor.decompress(data)
+
+class Lz4Compressor(_Compressor):
+    name = 'lz4'
+    compressor_id = 4
+
+    def __init__(self, level:int=None) -> None:
+        if lz4 is None:
+            raise ImportError('lz4 compression needs the lz4 package. pip install lz4')
+        super().__init__(level)
+
+    def compress(self, data) -> bytes:
+        return lz4.frame.compress(data, compression_level=0 if self.level is None else self.level)
+
+    def decompress(self, data) -> bytes:
+        return lz4.frame.decompress(data)
+
+COMPRESSORS = {
+    ZlibCompressor.name: ZlibCompressor,
+    LzmaCompressor.name: LzmaCompressor,
+    ZstdCompressor.name: ZstdCompressor,
+    Lz4Compressor.name: Lz4Compressor,
+}
+
+class Compression:
+    def __init__(self, compressor:str=None, threshold=4096, level:int=None) -> None:
+        """Compresses payloads on the way out and decompresses whatever comes in compressed.
+
+        Args:
+            compressor (str, optional): One of COMPRESSORS to compress with, None only decompresses. Defaults to None.
+            threshold (int, optional): Payloads smaller than this many bytes are sent as they are. Defaults to 4096.
+            level (int, optional): The compressor's level, None is a fast one. Defaults to None.
+        """
+        if compressor is not None and compressor not in COMPRESSORS:
+            raise KeyError(f'Unknown compressor "{compressor}". Options are {list(COMPRESSORS)}.')
+
+        self.name = compressor
+        self.threshold = threshold
+        self.level = level
+        self.compressor = None if compressor is None else COMPRESSORS[compressor](level)
+        self._by_id = {} if self.compressor is None else {self.compressor.compressor_id: self.compressor}
+        self.stats = CompressionStats()
+
+    def compress(self, payload) -> tuple:
+        """Returns (payload, compressor id), the id is 0 if it wasn't compressed."""
+        if self.compressor is None or len(payload) < self.threshold:
+            return payload, 0
+
+        start = time.perf_counter()
+        compressed = self.compressor.compress(payload)
+        self.stats.compress_seconds += time.perf_counter() - start
+
+        if len(compressed) >= len(payload):
+            self.stats.skipped += 1
+            return payload, 0
+
+        self.stats.compressed += 1
+        self.stats.bytes_in += len(payload)
+        self.stats.bytes_out += len(compressed)
+        return compressed, self.compressor.compressor_id
+
+    def decompress(self, payload, compressor_id: int):
+        if compressor_id == 0:
+            return payload
+
+        start = time.perf_counter()
+        payload = self._compressor(compressor_id).decompress(payload)
+        self.stats.decompress_seconds += time.perf_counter() - start
+        self.stats.decompressed += 1
+        return payload
+
+    def _compressor(self, compressor_id: int) -> _Compressor:
+        """Whatever the sender used, made the first time it's seen."""
+        compressor = self._by_id.get(compressor_id)
+        if compressor is None:
+            for class_ in COMPRESSORS.values():
+                if class_.compressor_id == compressor_id:
+                    compressor = self._by_id[compressor_id] = class_()
+                    break
+            else:
+                raise ValueError(f'Received a payload compressed with unknown compressor id {compressor_id}.')
+        return compressor
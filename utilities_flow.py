@@ -0,0 +1,132 @@
+#*Credit based flow control from a server to each of its clients.
+#*Every call sent to a client takes a credit and its reply gives it back, so a client never has more than credits calls waiting on it.
+#*Sends past that wait in a queue of up to queue_size and go out as replies come back.
+#*When the queue is full the policy decides what happens:
+#*  'block'        the send receives until there's room, for up to block_timeout seconds, then drops the new message
+#*  'drop-oldest'  the send that's been queued the longest is dropped to make room
+#*  'drop-newest'  the new send is dropped
+#*Dropped messages get the status 'dropped' and their futures fail with MessageDropped, so nothing is lost without anyone knowing.
+#*A queued call whose future times out is taken out of the queue, and a client that dies or is restarted gets all its credits back
+#*and its queue dropped, the replies to any of those are never coming.
+#*Memory is bounded by queue_size and latency by credits instead of by however much piles up in the sockets.
+
+from collections import deque
+from typing import List
+
+FLOW_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+class MessageDropped(Exception):
+    """A call was dropped by flow control instead of being sent."""
+
+class FlowControl:
+    def __init__(self, credits=100, queue_size=1000, policy='block', block_timeout=10) -> None:
+        """Flow control for one client, see ZMQServer.set_flow_control.
+
+        Args:
+            credits (int, optional): Calls that can be waiting on the client at once. Defaults to 100.
+            queue_size (int, optional): Sends held back once the credits are used up. Defaults to 1000.
+            policy (str, optional): What to do when the queue is full, one of FLOW_POLICIES. Defaults to 'block'.
+            block_timeout (float, optional): Seconds a 'block' send waits for room. Defaults to 10.
+        """
+        if policy not in FLOW_POLICIES:
+            raise ValueError(f'Unknown flow control policy "{policy}". Options are {FLOW_POLICIES}.')
+
+        self.credits = credits
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.queue = deque()#batches of messages, a single send is a batch of one
+        self.queue_length = 0#messages in the queue
+        self._in_flight = set()#id_ of every message sent and not replied to
+
+        #*Counters
+        self.sent = 0
+        self.queued = 0#ever put in the queue
+        self.dropped = 0
+        self.max_queued = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def ready(self, count=1) -> bool:
+        """There are credits for count more messages. A batch bigger than all the credits can still go when nothing is in flight."""
+        return not self.queue and (len(self._in_flight) + count <= self.credits or not self._in_flight)
+
+    def full(self, count=1) -> bool:
+        """count more messages could neither be sent nor queued."""
+        return not self.ready(count) and len(self.queue) >= self.queue_size
+
+    def take(self, messages: List):
+        for message in messages:
+            self._in_flight.add(message.id_)
+        self.sent += len(messages)
+
+    def release(self, id_: int) -> bool:
+        if id_ in self._in_flight:
+            self._in_flight.remove(id_)
+            return True
+        return False
+
+    def discard(self, id_: int) -> bool:
+        """Takes a message out of the queue, when whoever sent it has stopped waiting. Returns False if it wasn't queued."""
+        for index, messages in enumerate(self.queue):
+            for message in messages:
+                if message.id_ == id_:
+                    #*A new list, the batch is the one send_batch returned
+                    remaining = [other for other in messages if other is not message]
+                    if remaining:
+                        self.queue[index] = remaining
+                    else:
+                        del self.queue[index]
+                    self.queue_length -= 1
+                    self.dropped += 1
+                    return True
+        return False
+
+    def reset(self) -> List:
+        """Forgets everything in flight and empties the queue, for a client that died. Returns the messages that were queued."""
+        dropped = [message for messages in self.queue for message in messages]
+        self.queue.clear()
+        self.queue_length = 0
+        self._in_flight.clear()
+        self.dropped += len(dropped)
+        return dropped
+
+    def enqueue(self, messages: List) -> List:
+        """Queues a send that can't go yet. Returns the messages dropped to do it, if any."""
+        dropped = []
+        if len(self.queue) >= self.queue_size:
+            if self.policy == 'drop-oldest' and self.queue:
+                dropped = list(self.queue.popleft())
+                self.queue_length -= len(dropped)
+            else:
+                dropped = list(messages)
+                self.dropped += len(dropped)
+                return dropped
+            self.dropped += len(dropped)
+
+        self.queue.append(messages)
+        self.queue_length += len(messages)
+        self.queued += len(messages)
+        self.max_queued = max(self.max_queued, self.queue_length)
+        return dropped
+
+    def next_ready(self):
+        """The next queued send if there are credits for it, otherwise None."""
+        if self.queue and (len(self._in_flight) + len(self.queue[0]) <= self.credits or not self._in_flight):
+            messages = self.queue.popleft()
+            self.queue_length -= len(messages)
+            return messages
+
+    def stats(self) -> dict:
+        return {
+            'credits': self.credits,
+            'in_flight': self.in_flight,
+            'queued_now': self.queue_length,
+            'sent': self.sent,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'dropped': self.dropped,
+        }
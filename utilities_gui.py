@@ -94,8 +94,9 @@ def change_settings(settings):
 
             #Update things
             if event == '_SAVE_':
-                for key in settings._class_dict.keys():
-                    settings.__setattr__(key, window[key].get())
+                with settings.batch():#one write for the whole form
+                    for key in settings._class_dict.keys():
+                        settings.__setattr__(key, window[key].get())
                 window.close()
                 window.layout = None
                 window = None
@@ -0,0 +1,112 @@
+#*Client liveness from heartbeats.
+#*Every ZMQClient sends a 'heartbeat' message from its run loop every heartbeat seconds. The server never hands these to recv,
+#*they only update when the client was last heard from. Any other message from the client counts too.
+#*HeartbeatMonitor is checked every time the server receives, so it's watching as long as the state machine is receiving:
+#*  a ready client that hasn't been heard from for missed intervals is 'unresponsive' in client_dictionary, back to 'ready' when it's heard from again
+#*  a client whose process or thread has exited is 'dead'
+#*  (a not_started client is 'ready' as soon as it heartbeats, with or without a monitor, that's how respawned clients come back)
+#*With respawn, dead clients are started again the same way they were first started, after a backoff that doubles every time it dies again soon after.
+#*Calls a dead client never replied to fail with ClientDied straight away instead of waiting out their timeouts.
+
+import time
+
+from loguru import logger
+
+HEARTBEAT = 'heartbeat'
+
+class ClientDied(Exception):
+    """The client a call was sent to died or was restarted before it replied."""
+
+def is_alive(process) -> bool:
+    """For mp.Process, threading.Thread and subprocess.Popen."""
+    if hasattr(process, 'is_alive'):
+        return process.is_alive()
+    else:
+        return process.poll() is None
+
+class HeartbeatMonitor:
+    def __init__(self, server, interval=0.25, missed=3, respawn=False, backoff=0.5, max_backoff=30, hang_timeout=None) -> None:
+        """Watches the server's clients, see ZMQServer.enable_heartbeats.
+
+        Args:
+            server (ZMQServer): Whose client_dictionary to keep up to date
+            interval (float, optional): Seconds between heartbeats, clients started by the server after this are told to use it. Defaults to 0.25.
+            missed (int, optional): Heartbeats missed in a row before a client is unresponsive. Defaults to 3.
+            respawn (bool, optional): Start dead clients again. Defaults to False.
+            backoff (float, optional): Seconds before the first respawn. Defaults to 0.5.
+            max_backoff (float, optional): The longest wait between respawns. A client that stays up this long starts over at backoff. Defaults to 30.
+            hang_timeout (float, optional): Terminate clients unresponsive for this many seconds, so they're respawned too. None leaves them be. Defaults to None.
+        """
+        self.server = server
+        self.interval = interval
+        self.timeout = interval*missed
+        self.respawn = respawn
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hang_timeout = hang_timeout
+
+        self.last_seen = {}#client -> time.monotonic() it was last heard from
+        self.restarts = {}#client -> respawns since it last stayed up for max_backoff
+        self._started = {}#client -> time.monotonic() it was last respawned
+        self._respawn_at = {}#dead client -> time.monotonic() to start it again
+        self.next_check = 0#time.monotonic() of the next check that does anything
+
+    def seen(self, client: str):
+        self.last_seen[client] = time.monotonic()
+
+        state = self.server.client_dictionary.get(client)
+        if state == 'unresponsive':
+            self.server.client_dictionary[client] = 'ready'
+            logger.info(f'{client} is responding again.')
+
+    def check(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.interval/4
+
+        clients = self.server.client_dictionary
+        for client, state in list(clients.items()):
+            if state == 'closed':
+                continue
+
+            elif state == 'dead':
+                respawn_at = self._respawn_at.get(client)
+                if respawn_at is not None and now >= respawn_at:
+                    del self._respawn_at[client]
+                    self._respawn(client, now)
+                continue
+
+            process = self.server.processes.get(client)
+            if process is not None and not is_alive(process):
+                clients[client] = 'dead'
+                logger.error(f'{client} has died.')
+                self.server._forget_client(client)
+                if self.respawn and client in self.server._starters:
+                    delay = min(self.backoff * 2**self.restarts.get(client, 0), self.max_backoff)
+                    self._respawn_at[client] = now + delay
+                    logger.info(f'Respawning {client} in {delay:g} s.')
+                continue
+
+            if state in ('ready', 'unresponsive'):
+                silent = now - self.last_seen.setdefault(client, now)
+                if state == 'ready' and silent > self.timeout:
+                    clients[client] = 'unresponsive'
+                    logger.warning(f'{client} is unresponsive, not heard from for {silent:.3f} s.')
+                elif state == 'unresponsive' and self.hang_timeout is not None and silent > self.hang_timeout and hasattr(process, 'terminate'):
+                    logger.error(f'{client} has been unresponsive for {silent:.3f} s, terminating it.')
+                    process.terminate()
+
+                #*Up long enough that the next death isn't part of a crash loop
+                if self.restarts.get(client) and now - self._started.get(client, now) > self.max_backoff:
+                    self.restarts[client] = 0
+
+    def _respawn(self, client: str, now: float):
+        self.restarts[client] = self.restarts.get(client, 0) + 1
+        self._started[client] = now
+        self.last_seen.pop(client, None)
+        try:
+            self.server.restart_client(client)
+        except Exception:
+            logger.exception(f'Error respawning {client}.')
+            self._respawn_at[client] = now + min(self.backoff * 2**self.restarts[client], self.max_backoff)
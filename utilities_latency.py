@@ -0,0 +1,149 @@
+#*Latency histograms built from ZMQMessage.times.
+#*A reply to a call carries six timestamps:
+#*  server send, client recv, call start, call end, client return, server recv
+#*which split the round trip into
+#*  transit:   (client recv - server send) + (server recv - client return), time spent on the sockets
+#*  queueing:  (call start - client recv) + (client return - call end), time waiting in the client before the method started and for the reply to go out
+#*  execution: call end - call start, time in the method itself
+#*  total:     server recv - server send
+#*Messages a client sends on its own only have send and recv times, so they only count towards transit.
+
+#*The histograms are HDR style: a fixed array of counts in log-linear buckets, so recording a sample is an index calculation and an increment.
+#*With the default 5 significant bits every bucket is within about 3% of the values in it, from 1 us up to max_seconds.
+
+from array import array
+from pathlib import Path
+import json
+
+from utilities import Timer, write_atomically
+
+METRICS = ('transit', 'queueing', 'execution', 'total')
+
+class LatencyHistogram:
+    def __init__(self, significant_bits=5, max_seconds=3600) -> None:
+        """A fixed size histogram of durations.
+
+        Args:
+            significant_bits (int, optional): Bits of precision in each bucket. Defaults to 5.
+            max_seconds (float, optional): Longer durations are counted as this. Defaults to 3600.
+        """
+        self._bits = significant_bits
+        self._sub_count = 1 << significant_bits
+        self._half = self._sub_count >> 1
+        self._max_value = int(max_seconds*1e6)
+
+        bucket_count = self._index(self._max_value) + 1
+        self._counts = array('Q', bytes(8*bucket_count))
+
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self._bits
+        return self._sub_count + (shift-1)*self._half + (value >> shift) - self._half
+
+    def _highest_value(self, index: int) -> int:
+        """The largest value that lands in the bucket."""
+        if index < self._sub_count:
+            return index
+        shift, sub = divmod(index - self._sub_count, self._half)
+        shift += 1
+        return ((sub + self._half + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = min(max(round(seconds*1e6), 0), self._max_value)#in us, rounded since 0.013 - 0.003 is 9999.999 us, negative from clock skew counts as 0
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> float:
+        """Returns the duration in seconds that percent of the samples are at or below. None if there aren't any samples."""
+        if self.count == 0:
+            return None
+
+        target = max(1, int(percent/100*self.count + 0.5))
+        running = 0
+        for index, count in enumerate(self._counts):
+            running += count
+            if running >= target:
+                return min(self._highest_value(index), self.max) / 1e6
+
+    @property
+    def mean(self) -> float:
+        return None if self.count == 0 else self.sum / self.count / 1e6
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max / 1e6 if self.count else None,
+        }
+
+    def clear(self):
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+class LatencyStats:
+    def __init__(self, dump_path=None, dump_period=60, significant_bits=5, max_seconds=3600) -> None:
+        """Per client, per function latency histograms.
+
+        Args:
+            dump_path (str, optional): JSON file the summary is written to every dump_period seconds. None never writes. Defaults to None.
+            dump_period (float, optional): Defaults to 60.
+        """
+        self.dump_path = dump_path
+        self._dump_timer = Timer(dump_period)
+        self._histogram_args = (significant_bits, max_seconds)
+        self._histograms = {}#(client, function) -> {metric: LatencyHistogram}
+
+    def _get(self, client: str, function: str) -> dict:
+        key = (client, function)
+        histograms = self._histograms.get(key)
+        if histograms is None:
+            histograms = self._histograms[key] = {metric: LatencyHistogram(*self._histogram_args) for metric in METRICS}
+        return histograms
+
+    def record(self, message):
+        """Adds a received message's times to its client and function's histograms."""
+        times = message.times
+        if len(times) >= 6:#a reply to a call
+            sent, client_recv, call_start, call_end, returned, recv = times[:6]
+            histograms = self._get(message.client, message.function)
+            histograms['transit'].record((client_recv - sent) + (recv - returned))
+            histograms['queueing'].record((call_start - client_recv) + (returned - call_end))
+            histograms['execution'].record(call_end - call_start)
+            histograms['total'].record(recv - sent)
+        elif len(times) >= 2:#sent by the client on its own
+            self._get(message.client, message.function)['transit'].record(times[-1] - times[0])
+
+        if self.dump_path is not None and self._dump_timer.finished:
+            self._dump_timer.reset()
+            self.dump()
+
+    def summary(self, client: str=None, function: str=None) -> dict:
+        """Returns {client: {function: {metric: {count, mean, p50, p95, p99, max}}}} in seconds, optionally just one client or function."""
+        summary = {}
+        for (client_, function_), histograms in self._histograms.items():
+            if (client is None or client == client_) and (function is None or function == function_):
+                summary.setdefault(client_, {})[str(function_)] = {metric: histogram.summary() for metric, histogram in histograms.items() if histogram.count}
+        return summary
+
+    def dump(self, path=None):
+        """Writes the summary to a JSON file, by way of a temporary file so a reader never sees half of it."""
+        write_atomically(Path(self.dump_path if path is None else path), json.dumps(self.summary(), indent=4))
+
+    def clear(self):
+        for histograms in self._histograms.values():
+            for histogram in histograms.values():
+                histogram.clear()
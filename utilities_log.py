@@ -5,6 +5,9 @@
 #*TRACE
 #*I recently added this log level, I intend to use it for things like logging every ZMQ message sent, which is sometimes nice but is also often clutter.
 #*I put this in it's own folder because it might end up with a bunch of files since it logs every.
+#*Turning every message into a string costs more than sending it, so it's gated twice. trace_message returns without building anything
+#*unless some loguru sink takes TRACE, whoever set the sinks up, and then only one message in every trace is logged.
+#*log_start(process, trace=0) leaves the trace sink off, trace=1 logs every message, the default of 100 logs one in 100.
 
 #*DEBUG
 #*This is the main log file I look at. I use logger.debug('text') when I want to log something but not print it.
@@ -36,20 +39,29 @@
 
 from loguru import logger
 
-def log_start(process='main'):
+TRACE_SAMPLE = 100
+_TRACE_LEVEL = logger.level('TRACE').no
+_trace_every = TRACE_SAMPLE#0 is off, otherwise every nth message is traced
+_trace_count = 0
+
+def log_start(process='main', trace=TRACE_SAMPLE):
+    global _trace_every
+    _trace_every = int(trace)
+
     logger.remove()
 
     #*TRACE
-    logger.add(
-        f"logs/trace/{process} trace.log",
-        level='TRACE',
-        backtrace = False,
-        enqueue = True,
-        rotation = '8 MB',
-        compression = 'zip',
-        retention = '1 week',
-        format = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{module:<20}</cyan> <cyan>{line:>4}</cyan> | <level>{message}</level>"
-    )
+    if trace:
+        logger.add(
+            f"logs/trace/{process} trace.log",
+            level='TRACE',
+            backtrace = False,
+            enqueue = True,
+            rotation = '8 MB',
+            compression = 'zip',
+            retention = '1 week',
+            format = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{module:<20}</cyan> <cyan>{line:>4}</cyan> | <level>{message}</level>"
+        )
 
     #*DEBUG
     logger.add(
@@ -88,6 +100,25 @@ def log_start(process='main'):
     logger.debug('________________________________________________________________________')
     logger.debug(f'Start of {process} log')
 
+def trace_setting() -> int:
+    """The trace argument log_start was given, so child processes can be started with the same one."""
+    return _trace_every
+
+def set_trace_sampling(trace: int):
+    """For processes that set loguru up themselves instead of with log_start. 1 traces every message, n one in n, 0 none."""
+    global _trace_every
+    _trace_every = int(trace)
+
+def trace_message(prefix: str, message):
+    """Logs a ZMQ message at TRACE. The message is only turned into a string if a sink takes TRACE and this one is sampled."""
+    global _trace_count
+    #*loguru keeps the lowest level of all its sinks, there's no public way to ask it
+    if _trace_every and logger._core.min_level <= _TRACE_LEVEL:
+        _trace_count += 1
+        if _trace_count >= _trace_every:
+            _trace_count = 0
+            logger.opt(depth=1).trace(f'{prefix} {message}')
+
 def trace(*args, **kwargs):
     return logger.trace(*args, **kwargs)
 
@@ -0,0 +1,167 @@
+#*An event driven loop for state machines.
+#*Instead of a while loop that calls recv(timeout=10) and checks Timers, a state registers what it wants to happen and calls react():
+#*  add_reader(socket, callback)    callback(socket) when a zmq socket (or anything zmq.Poller takes, like a file descriptor) is readable
+#*  call_at / call_later / call_every   callbacks at their exact deadlines, every one waits on the same poll
+#*  add_gui(update)                 calls a window's update (read with timeout=0) at a steady rate, and stops when it returns False
+#*  add_timer(timer, callback)      a utilities.Timer, so states can hand existing Timers over instead of checking them
+#*  add_hook(hook)                  called every time around, returns seconds until it next needs to run
+#*and stop(result) from any callback ends run() with result. Everything sleeps in a single zmq.Poller.poll until the next event or deadline,
+#*so an idle process with no timers doesn't wake at all.
+#*tk windows have no file descriptor to poll on every platform, so add_gui polls the window on a timer, 60 times a second by default.
+
+import heapq
+import itertools
+import math
+import time
+from typing import Callable
+
+import zmq
+
+from utilities import Timer, TimerScheduler
+
+class ReactorTimer:
+    """A scheduled callback. cancel() stops it, even a repeating one from inside its own callback."""
+    __slots__ = ('deadline', 'interval', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, interval: float, callback: Callable, args: tuple) -> None:
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Reactor:
+    def __init__(self) -> None:
+        self._poller = zmq.Poller()
+        self._readers = {}#socket -> callback
+        self._timers = []#heap of (deadline, sequence, ReactorTimer), the sequence keeps timers with the same deadline in order
+        self._sequence = itertools.count()
+        self._hooks = []
+        self.timers = TimerScheduler()
+        self.running = False
+        self._result = None
+
+    def add_reader(self, socket, callback: Callable):
+        if socket not in self._readers:
+            self._poller.register(socket, zmq.POLLIN)
+        self._readers[socket] = callback
+
+    def remove_reader(self, socket):
+        if self._readers.pop(socket, None) is not None:
+            self._poller.unregister(socket)
+
+    def call_at(self, deadline: float, callback: Callable, *args) -> ReactorTimer:
+        """Calls callback(*args) at deadline, in time.monotonic() seconds."""
+        return self._schedule(ReactorTimer(deadline, None, callback, args))
+
+    def call_later(self, delay: float, callback: Callable, *args) -> ReactorTimer:
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_every(self, interval: float, callback: Callable, *args) -> ReactorTimer:
+        """Calls callback(*args) every interval seconds, first after one interval. It keeps to the schedule, a late call doesn't push the next one back."""
+        if not interval > 0:
+            raise ValueError(f'call_every needs an interval greater than 0, not {interval}. Use add_hook to run something every time round the loop.')
+        return self._schedule(ReactorTimer(time.monotonic() + interval, interval, callback, args))
+
+    def _schedule(self, timer: ReactorTimer) -> ReactorTimer:
+        heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+        return timer
+
+    def add_timer(self, timer: Timer, callback: Callable, repeat=False) -> Timer:
+        """Calls callback(timer) when timer finishes, and every time after that with repeat. Resetting the timer pushes the call back."""
+        return self.timers.add(timer, callback=callback, repeat=repeat)
+
+    def add_gui(self, update: Callable, period=1/60) -> ReactorTimer:
+        """Calls update(timeout=0) every period seconds. When it returns False, the window was closed, run() stops and returns None."""
+        def _update():
+            if not update(timeout=0):
+                self.stop(None)
+        return self.call_every(period, _update)
+
+    def add_hook(self, hook: Callable):
+        """hook() is called every time around the loop and returns seconds until it needs calling again, or None if it only needs to run on events."""
+        self._hooks.append(hook)
+
+    def stop(self, result=None):
+        """Makes run() return result once the current callback is done."""
+        self.running = False
+        self._result = result
+
+    def clear(self):
+        """Removes every reader, timer and hook."""
+        for socket in list(self._readers):
+            self.remove_reader(socket)
+        self._timers.clear()
+        self._hooks.clear()
+        self.timers = TimerScheduler()
+
+    def run(self, timeout: float=None):
+        """Waits on events and fires timers until stop is called, or for up to timeout seconds.
+
+        Returns:
+            any: What was passed to stop, None if it timed out
+        """
+        self.running = True
+        self._result = None
+        end = None if timeout is None else time.monotonic() + timeout
+        try:
+            while self.running:
+                wait = self._run_hooks()
+
+                now = time.monotonic()
+                while self._timers and self._timers[0][2].cancelled:
+                    heapq.heappop(self._timers)
+                if self._timers:
+                    wait = _earliest(wait, self._timers[0][0] - now)
+                wait = _earliest(wait, self.timers.time_until_next())
+                if end is not None:
+                    if now >= end:
+                        break
+                    wait = _earliest(wait, end - now)
+
+                #*Rounded up to the next millisecond, so the poll never comes back just before a deadline and spins
+                for socket, _ in self._poller.poll(None if wait is None else math.ceil(max(wait, 0)*1000)):
+                    if not self.running:
+                        break
+                    callback = self._readers.get(socket)
+                    if callback is not None:
+                        callback(socket)
+
+                self._fire_timers()
+                if self.running:
+                    self.timers.run_due()
+
+            return self._result
+        finally:
+            self.running = False
+
+    def _run_hooks(self):
+        wait = None
+        for hook in self._hooks:
+            wait = _earliest(wait, hook())
+        return wait
+
+    def _fire_timers(self):
+        now = time.monotonic()
+        while self.running and self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+
+            if timer.interval is not None:
+                while timer.deadline <= now:
+                    timer.deadline += timer.interval
+                self._schedule(timer)
+
+            timer.callback(*timer.args)
+
+def _earliest(a, b):
+    if a is None:
+        return b
+    elif b is None:
+        return a
+    else:
+        return min(a, b)
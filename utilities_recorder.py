@@ -0,0 +1,195 @@
+#*A flight recorder for ZMQ traffic.
+#*Every multipart message sent or received is copied, still encoded, into a fixed size ring of bytes. Nothing is turned into a string,
+#*the ring itself is never reallocated and per message there's only a memoryview of each frame and an entry in the deque of records,
+#*but that's still a copy of every message, so servers and clients only keep one when they're made with flight_recorder=True.
+#*When something goes wrong the ring is dumped to a file and read back with FlightRecorder.read to see the last few MB of messages leading up to it.
+
+#*Each record is
+#*  time (d), direction (B), frame count (H)
+#*then for each frame
+#*  length (I), stored length (I), stored bytes
+#*Frames longer than max_frame_bytes only keep their first max_frame_bytes, big buffers would push everything else out of the ring.
+
+#*TrafficRecorder is the same records written straight to a file instead, every frame whole, for capturing real traffic to replay later (see utilities_replay).
+#*The file is only ever appended to, so a crash loses at most what was still buffered. Next to it is an index file of
+#*  offset (Q), time (d)
+#*for every record, so a replay can start at any record or time without reading everything before it.
+#*Index entries are held back until the capture has been flushed past their records, so the index never points past the end of the capture.
+#*If the index is missing or short TrafficReader rebuilds it from the capture, and if the capture was cut short anyway (the disk filled up,
+#*or it was copied part way through) it leaves out the entries past the end.
+
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import List
+import struct
+import time
+
+from loguru import logger
+
+from utilities import write_atomically
+
+SENT = 0
+RECEIVED = 1
+
+_MAGIC = b'ZMQFR1\n'
+_TRAFFIC_MAGIC = b'ZMQTR1\n'
+_RECORD = struct.Struct('!dBH')
+_FRAME = struct.Struct('!II')
+_INDEX = struct.Struct('!Qd')
+_INDEX_BATCH = 4096*_INDEX.size#bytes of index entries held back before the capture is flushed and they're written
+
+class FlightRecorder:
+    def __init__(self, name='main', capacity=4*1024*1024, max_frame_bytes=4096, folder='logs/flight') -> None:
+        """The last capacity bytes of messages, ready to be dumped.
+
+        Args:
+            name (str, optional): Used in the dump file name. Defaults to 'main'.
+            capacity (int, optional): Size of the ring in bytes. Defaults to 4 MB.
+            max_frame_bytes (int, optional): Frames are cut to this many bytes. Defaults to 4096.
+            folder (str, optional): Where dump puts its files. Defaults to 'logs/flight'.
+        """
+        self.name = name
+        self.capacity = capacity
+        self.max_frame_bytes = max_frame_bytes
+        self.folder = folder
+
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._write = 0
+        self._records = deque()#(start, length) of each record, oldest first
+
+    def record(self, direction: int, frames: List[bytes]):
+        """Copies a multipart message into the ring, overwriting the oldest records to make room."""
+        now = time.time()
+        frames = [memoryview(frame) for frame in frames]
+
+        length = _RECORD.size
+        for frame in frames:
+            length += _FRAME.size + min(frame.nbytes, self.max_frame_bytes)
+        if length > self.capacity:
+            return
+
+        #*Wrap to the start when it doesn't fit before the end. The abandoned tail holds the oldest records, so they go first.
+        if self._write + length > self.capacity:
+            while self._records and self._records[0][0] >= self._write:
+                self._records.popleft()
+            self._write = 0
+
+        #*The records just past the write position are always the oldest ones
+        end = self._write + length
+        while self._records and self._write <= self._records[0][0] < end:
+            self._records.popleft()
+
+        position = self._write
+        _RECORD.pack_into(self._buffer, position, now, direction, len(frames))
+        position += _RECORD.size
+        for frame in frames:
+            frame = frame.cast('B')
+            stored = min(frame.nbytes, self.max_frame_bytes)
+            _FRAME.pack_into(self._buffer, position, frame.nbytes, stored)
+            position += _FRAME.size
+            self._view[position:position+stored] = frame[:stored]
+            position += stored
+
+        self._records.append((self._write, length))
+        self._write = end
+
+    def __len__(self):
+        return len(self._records)
+
+    def dump(self, path=None) -> Path:
+        """Writes every record in the ring, oldest first. The default path is folder/name time.bin.
+
+        Returns:
+            Path: The file written
+        """
+        if path is None:
+            path = Path(self.folder) / f'{self.name} {datetime.now().strftime("%Y-%m-%d %H-%M-%S-%f")}.bin'
+        path = Path(path)
+        write_atomically(path, [_MAGIC, *(self._view[start:start+length] for start, length in self._records)])
+
+        logger.debug(f'Dumped {len(self._records)} messages to {path}')
+
+        return path
+
+    def clear(self):
+        self._records.clear()
+        self._write = 0
+
+    @staticmethod
+    def read(path):
+        """Yields (time, direction, frames) for each record in a dump, oldest first.
+        Frames are bytes, cut short ones are shorter than the length the frame had when it was recorded.
+        Decode them with the codec they were sent with, e.g. get_codec('json').decode_many(frames[1:]).
+        """
+        data = Path(path).read_bytes()
+        if not data.startswith(_MAGIC):
+            raise ValueError(f'{path} is not a flight recorder dump.')
+
+        position = len(_MAGIC)
+        while position < len(data):
+            time_, direction, frame_count = _RECORD.unpack_from(data, position)
+            position += _RECORD.size
+
+            frames = []
+            for _ in range(frame_count):
+                _, stored = _FRAME.unpack_from(data, position)
+                position += _FRAME.size
+                frames.append(data[position:position+stored])
+                position += stored
+
+            yield time_, direction, frames
+
+def index_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + '.idx')
+
+class TrafficRecorder:
+    def __init__(self, path) -> None:
+        """Appends every message to path, and its offset and time to path.idx. An existing capture is added to.
+
+        Args:
+            path (str | Path): The capture file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._file = open(self.path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_TRAFFIC_MAGIC)
+        self._index = open(index_path(self.path), 'ab')
+        #*An entry cut off part way through (the recorder was killed) would put every entry after it out of line
+        size = self._index.tell()
+        if size % _INDEX.size:
+            self._index.truncate(size - size % _INDEX.size)
+        self._held = bytearray()#index entries of records that may still be in the capture's buffer
+        self.count = 0
+
+    def record(self, direction: int, frames: List[bytes]):
+        now = time.time()
+        frames = [memoryview(frame).cast('B') for frame in frames]
+
+        offset = self._file.tell()
+        self._file.write(_RECORD.pack(now, direction, len(frames)))
+        for frame in frames:
+            self._file.write(_FRAME.pack(frame.nbytes, frame.nbytes))
+            self._file.write(frame)
+        self._held += _INDEX.pack(offset, now)
+        self.count += 1
+        if len(self._held) >= _INDEX_BATCH:
+            self.flush()
+
+    def flush(self):
+        """Flushes the capture, then writes the index entries of everything in it."""
+        self._file.flush()
+        self._index.write(self._held)
+        self._held.clear()
+        self._index.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+            self._index.close()
+            logger.debug(f'Recorded {self.count} messages to {self.path}')
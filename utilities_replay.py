@@ -0,0 +1,317 @@
+#*Replaying captures made with ZMQServer.record_traffic, so state machines, clients and the GUI can be profiled against real message streams
+#*without the instruments that made them.
+#*  ReplayClients stands in for every client in the capture. It sends what the server received, with the original timing,
+#*                and answers ping and close itself so wait_for_all_clients_ready and close work as usual.
+#*                The server has to expect the clients, e.g. client_dictionary[name] = 'not_started' instead of starting them,
+#*                the replayed heartbeats then make them ready.
+#*  ReplayServer  stands in for the server. It sends what the server sent to clients that are started and connected as usual.
+#*Frames go out exactly as they were recorded, so both ends have to use the codec the capture was made with.
+#*speed is how many times faster than recorded to go, 1 is real time and 0 (or None) is as fast as the sockets go.
+#*Run from the command line with: python utilities_replay.py capture.bin --as clients --speed 2
+
+from bisect import bisect_left
+from pathlib import Path
+from typing import List
+import argparse
+import math
+import mmap
+import struct
+import time
+
+import zmq
+from loguru import logger
+
+from utilities_recorder import _TRAFFIC_MAGIC, _RECORD, _FRAME, _INDEX, SENT, RECEIVED, index_path
+from utilities_zmq import ZMQMessage, ALL_TOPIC, topic, endpoint, available_transports, get_codec, _shared_context
+
+class TrafficReader:
+    def __init__(self, path) -> None:
+        """Random access to the records of a capture, through its index.
+
+        Args:
+            path (str | Path): The capture file, path.idx next to it is its index
+        """
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(_TRAFFIC_MAGIC)] != _TRAFFIC_MAGIC:
+            raise ValueError(f'{path} is not a traffic capture.')
+
+        self.offsets = []
+        self.times = []
+        self._read_index()
+
+    def _read_index(self):
+        try:
+            index = index_path(self.path).read_bytes()
+        except FileNotFoundError:
+            index = b''
+        for offset, time_ in _INDEX.iter_unpack(index[:len(index) - len(index) % _INDEX.size]):
+            if offset >= len(self._data):#the capture was cut off before this record
+                break
+            self.offsets.append(offset)
+            self.times.append(time_)
+
+        #*The last indexed record can be cut off too, then it's left out and the index is rebuilt from the one before
+        position = len(_TRAFFIC_MAGIC)
+        while self.offsets:
+            try:
+                position = self._end(self.offsets[-1])
+                break
+            except (struct.error, ValueError):
+                self.offsets.pop()
+                self.times.pop()
+
+        #*Records the index didn't get to before the recorder stopped
+        while position < len(self._data):
+            try:
+                end = self._end(position)
+            except (struct.error, ValueError):#a record cut off part way through
+                logger.warning(f'{self.path} ends with a partial record.')
+                break
+            self.offsets.append(position)
+            self.times.append(_RECORD.unpack_from(self._data, position)[0])
+            position = end
+
+    def _end(self, offset: int) -> int:
+        """Where the record at offset ends."""
+        _, _, frame_count = _RECORD.unpack_from(self._data, offset)
+        position = offset + _RECORD.size
+        for _ in range(frame_count):
+            _, stored = _FRAME.unpack_from(self._data, position)
+            position += _FRAME.size + stored
+        if position > len(self._data):
+            raise ValueError('Record runs past the end of the capture.')
+        return position
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> tuple:
+        """(time, direction, frames) of a record."""
+        position = self.offsets[index]
+        time_, direction, frame_count = _RECORD.unpack_from(self._data, position)
+        position += _RECORD.size
+
+        frames = []
+        for _ in range(frame_count):
+            _, stored = _FRAME.unpack_from(self._data, position)
+            position += _FRAME.size
+            frames.append(self._data[position:position+stored])
+            position += stored
+
+        return time_, direction, frames
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def index_at(self, time_: float) -> int:
+        """The first record at or after time_, in time.time() seconds."""
+        return bisect_left(self.times, time_)
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1] - self.times[0] if self.times else 0
+
+    def clients(self) -> List[str]:
+        """Every client that sent or was sent something, other than 'all'."""
+        names = set()
+        for index in range(len(self)):
+            topic_ = self._topic(index)
+            if topic_ != ALL_TOPIC:
+                names.add(topic_[:-1].decode('utf-8'))
+        return sorted(names)
+
+    def _topic(self, index: int) -> bytes:
+        position = self.offsets[index] + _RECORD.size
+        _, stored = _FRAME.unpack_from(self._data, position)
+        position += _FRAME.size
+        return self._data[position:position+stored]
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+class _Replayer:
+    direction = None#which of the recorded messages this side sends
+
+    def __init__(self, capture, codec='json') -> None:
+        self.reader = capture if isinstance(capture, TrafficReader) else TrafficReader(capture)
+        self.codec = get_codec(codec)
+        self.clients = self.reader.clients()
+        self.received = 0
+        self._context = _shared_context(zmq.Context)
+
+    def run(self, speed=1.0, start=0, stop:int=None, wait=10) -> dict:
+        """Sends the capture's records from start up to stop.
+
+        Args:
+            speed (float, optional): Times faster than recorded, 0 or None goes as fast as possible. Defaults to 1.0.
+            start (int, optional): The first record, see TrafficReader.index_at to start at a time. Defaults to 0.
+            stop (int, optional): The record to stop before. None plays to the end. Defaults to None.
+            wait (float, optional): Seconds to wait for the other side to connect first, None doesn't wait. Defaults to 10.
+
+        Returns:
+            dict: How it went, messages sent, how long it took and was recorded over, and how late the latest message went out
+        """
+        if wait is not None:
+            self._wait_for_connection(wait)
+
+        stop = len(self.reader) if stop is None else stop
+        first = None
+        sent = 0
+        max_lag = 0
+        began = time.perf_counter()
+
+        for index in range(start, stop):
+            time_, direction, frames = self.reader[index]
+            if direction != self.direction:
+                continue
+
+            if speed:
+                if first is None:
+                    first = time_
+                due = began + (time_ - first)/speed
+                self._serve_until(due)
+                max_lag = max(max_lag, time.perf_counter() - due)
+            else:
+                self._serve_until(0)
+
+            self._pub_socket.send_multipart(frames, copy=False)
+            sent += 1
+
+        seconds = time.perf_counter() - began
+        recorded = self.reader.times[stop-1] - self.reader.times[start] if stop > start else 0
+        result = {
+            'sent': sent,
+            'received': self.received,
+            'seconds': seconds,
+            'recorded_seconds': recorded,
+            'speed': recorded/seconds if seconds else 0,
+            'rate': sent/seconds if seconds else 0,
+            'max_lag': max_lag,
+        }
+        logger.info(f'Replayed {sent} messages from {self.reader.path} in {seconds:.3f} s, {result["speed"]:.2f}x, up to {max_lag*1000:.2f} ms late')
+        return result
+
+    def serve(self, timeout=1.0):
+        """Keeps answering for timeout seconds after a replay, so the other side can finish up (close for example)."""
+        self._serve_until(time.perf_counter() + timeout)
+
+    def _serve_until(self, deadline: float):
+        """Handles incoming messages until deadline, in time.perf_counter() seconds. A deadline that's passed just handles what's waiting."""
+        while True:
+            remaining = deadline - time.perf_counter()
+            if not self._sub_socket.poll(timeout=math.ceil(max(0, remaining*1000))):
+                if remaining <= 0:
+                    return
+                continue
+            self.received += 1
+            self._handle(self._sub_socket.recv_multipart(copy=False))
+
+    def _handle(self, frames: list):
+        pass
+
+    def _wait_for_connection(self, timeout: float):
+        raise NotImplementedError
+
+    def close(self, linger=1000):
+        self._pub_socket.close(linger=linger)
+        self._sub_socket.close(linger=0)
+        self.reader.close()
+
+class ReplayClients(_Replayer):
+    direction = RECEIVED
+
+    def __init__(self, capture, send_port=5555, recv_port=5556, address='localhost', transport='tcp', codec='json') -> None:
+        """Connects to a server like its clients would, see the top of this file.
+
+        Args:
+            capture (str | Path | TrafficReader): The capture to replay
+            send_port (int, optional): The server's send_port. Defaults to 5555.
+            recv_port (int, optional): The server's recv_port. Defaults to 5556.
+        """
+        super().__init__(capture, codec)
+
+        self._pub_socket = self._context.socket(zmq.PUB)
+        self._pub_socket.connect(endpoint(transport, address, recv_port))
+
+        self._sub_socket = self._context.socket(zmq.SUB)
+        self._sub_socket.setsockopt(zmq.SUBSCRIBE, b'')#standing in for every client
+        self._sub_socket.connect(endpoint(transport, address, send_port))
+
+    def _handle(self, frames: list):
+        """Answers ping and close for the clients being replayed, everything else was answered in the capture."""
+        topic_, *frames = frames
+        now = time.time()
+        for message in self.codec.decode_many(frames):
+            if message.function not in ('ping', 'close'):
+                continue
+
+            clients = self.clients if memoryview(topic_) == ALL_TOPIC else [message.client]
+            for client in clients:
+                reply = ZMQMessage(server=message.server, client=client, function=message.function, args=message.args, kwargs=message.kwargs,
+                                   status='success', return_='pong' if message.function == 'ping' else None,
+                                   times=message.times + [now]*4, id_=message.id_)
+                self._pub_socket.send_multipart([topic(client), *self.codec.encode(reply)], copy=False)
+
+    def _wait_for_connection(self, timeout: float):
+        """Servers ping while they wait for clients, so the first thing heard from it means both sockets are connected."""
+        deadline = time.perf_counter() + timeout
+        while self.received == 0 and time.perf_counter() < deadline:
+            self._serve_until(min(deadline, time.perf_counter() + 0.1))
+        if self.received == 0:
+            logger.warning(f'Nothing heard from the server in {timeout} s, replaying anyway.')
+
+class ReplayServer(_Replayer):
+    direction = SENT
+
+    def __init__(self, capture, send_port=5555, recv_port=5556, address='127.0.0.1', transports:List[str]=None, codec='json') -> None:
+        """Binds like a ZMQServer would, see the top of this file."""
+        super().__init__(capture, codec)
+        transports = available_transports() if transports is None else transports
+
+        self._pub_socket = self._context.socket(zmq.PUB)
+        for transport in transports:
+            self._pub_socket.bind(endpoint(transport, address, send_port))
+
+        self._sub_socket = self._context.socket(zmq.SUB)
+        self._sub_socket.setsockopt(zmq.SUBSCRIBE, b'')
+        for transport in transports:
+            self._sub_socket.bind(endpoint(transport, address, recv_port))
+
+        self.heard_from = set()
+
+    def _handle(self, frames: list):
+        self.heard_from.add(bytes(frames[0])[:-1].decode('utf-8'))
+
+    def _wait_for_connection(self, timeout: float):
+        """Clients heartbeat as soon as they start, so once every client in the capture has been heard from they're all subscribed."""
+        deadline = time.perf_counter() + timeout
+        while not self.heard_from.issuperset(self.clients) and time.perf_counter() < deadline:
+            self._serve_until(min(deadline, time.perf_counter() + 0.1))
+        missing = set(self.clients) - self.heard_from
+        if missing:
+            logger.warning(f'Not heard from {sorted(missing)} in {timeout} s, replaying anyway.')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a capture from ZMQServer.record_traffic')
+    parser.add_argument('capture')
+    parser.add_argument('--as', dest='side', choices=['clients', 'server'], default='clients', help='Which side to stand in for')
+    parser.add_argument('--speed', type=float, default=1.0, help='Times faster than recorded, 0 is as fast as possible')
+    parser.add_argument('--send-port', type=int, default=5555)
+    parser.add_argument('--recv-port', type=int, default=5556)
+    parser.add_argument('--codec', default='json')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--stop', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.side == 'clients':
+        replayer = ReplayClients(args.capture, send_port=args.send_port, recv_port=args.recv_port, codec=args.codec)
+    else:
+        replayer = ReplayServer(args.capture, send_port=args.send_port, recv_port=args.recv_port, codec=args.codec)
+
+    print(replayer.run(speed=args.speed, start=args.start, stop=args.stop))
+    replayer.serve()
+    replayer.close()
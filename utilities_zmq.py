@@ -1,18 +1,53 @@
 import time
 from typing import List, Dict
 import multiprocessing as mp
+import sys
 import subprocess
 from pathlib import Path
 from traceback import format_exc
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import socket
+import asyncio
+from collections import deque
+import heapq
+import inspect
+import json
+import pickle
+import struct
+import array
+import io
+import tempfile
+import os
+import threading
+from datetime import datetime
 
 import zmq
 from loguru import logger
 
+try:
+    import msgpack
+except ImportError:#msgpack is optional, the json and pickle codecs work without it
+    msgpack = None
+
+try:
+    import psutil
+except ImportError:#psutil is optional, it's only used to pin and renice clients where os can't (Windows)
+    psutil = None
+
 from utilities import Timer
-from utilities_log import log_start
+from utilities_log import log_start, trace_message, trace_setting
+from utilities_latency import LatencyStats
+from utilities_recorder import FlightRecorder, TrafficRecorder, SENT, RECEIVED
+from utilities_heartbeat import HeartbeatMonitor, ClientDied, HEARTBEAT
+from utilities_compression import Compression
+from utilities_flow import FlowControl, MessageDropped, FLOW_POLICIES
+from utilities_reactor import Reactor
 
 class ZMQMessage:
-    def __init__(self, server:str=None, client:str=None, function:str=None, args:List[any]=None, kwargs:Dict[str, any]=None, return_:List[any]=None, status:str=None, times:List[any]=[], id_:int=None, dont_log_args:bool=False, dont_log_return:bool=False):
+    __slots__ = ('server', 'client', 'function', 'args', 'kwargs', 'return_', 'status', 'times', 'id_', 'dont_log_args', 'dont_log_return')
+
+    def __init__(self, server:str=None, client:str=None, function:str=None, args:List[any]=None, kwargs:Dict[str, any]=None, return_:List[any]=None, status:str=None, times:List[any]=None, id_:int=None, dont_log_args:bool=False, dont_log_return:bool=False):
         self.server: str = server
         self.client: str = client
         self.function: str = function
@@ -20,48 +55,629 @@ class ZMQMessage:
         self.kwargs: Dict[str, any] = {} if kwargs is None else kwargs
         self.return_: List[any] = [] if return_ is None else return_
         self.status: str = status
-        self.times: List[int] = times
+        self.times: List[float] = [] if times is None else times
         self.id_: int = id_
         self.dont_log_args: bool = dont_log_args
         self.dont_log_return: bool = dont_log_return
 
+    def to_dict(self) -> Dict[str, any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
     def __str__(self):
-        dict = self.__dict__
+        dict = self.to_dict()
         #*Remove hidden 
-        if self.dont_log_args or self.dont_log_return:
-            dict = dict.copy()
-
-            if self.dont_log_args:
-                dict['args'] = ['***']
-                dict['kwargs'] = {'***': '***'}
+        if self.dont_log_args:
+            dict['args'] = ['***']
+            dict['kwargs'] = {'***': '***'}
 
-            if self.dont_log_return:
-                dict['return_'] = ['***']
+        if self.dont_log_return:
+            dict['return_'] = ['***']
 
         return str(dict)
 
+class _NullMessage(ZMQMessage):
+    """What recv returns when nothing arrived. There is only one, NULL_MESSAGE, so polling doesn't allocate."""
+    __slots__ = ()
+
+    def __init__(self):
+        for slot, value in (('args', ()), ('kwargs', {}), ('return_', ()), ('times', ()), ('dont_log_args', False), ('dont_log_return', False)):
+            object.__setattr__(self, slot, value)
+        for slot in ('server', 'client', 'function', 'status', 'id_'):
+            object.__setattr__(self, slot, None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('NULL_MESSAGE is shared and can not be changed. Make a new ZMQMessage instead.')
+
+NULL_MESSAGE = _NullMessage()
+
+#*Every message goes over the socket as a fixed binary header frame, a payload frame, then any out-of-band buffer frames.
+#*The header holds everything the routing and logging needs so it can be read without touching the payload:
+#*  codec id, id_, flags, the lengths of server, client, function and status, the number of times, the number of buffers,
+#*  then the utf-8 server, client, function and status strings, then the times as doubles.
+#*The payload is [args, kwargs, return_] encoded by the codec. JSON is the default.
+#*The server and all of its clients have to use the same codec, the codec id in the header makes a mismatch fail loudly.
+_HEADER = struct.Struct('!BiBBBBBBH')
+_NONE_LENGTH = 255#a string length of 255 means the field is None
+_FLAG_DONT_LOG_ARGS = 1
+_FLAG_DONT_LOG_RETURN = 2
+_FLAG_NO_ID = 4
+#*Bits 3 to 5 of the flags are the id of the compressor the payload was compressed with, 0 for none, see utilities_compression
+_COMPRESSION_SHIFT = 3
+_COMPRESSION_MASK = 0b111 << _COMPRESSION_SHIFT
+
+def _pack_string(string: str) -> bytes:
+    return b'' if string is None else string.encode('utf-8')
+
+def _string_length(string: str, encoded: bytes) -> int:
+    if string is None:
+        return _NONE_LENGTH
+    elif len(encoded) >= _NONE_LENGTH:
+        raise ValueError(f'"{string}" is too long for a message header, the limit is {_NONE_LENGTH-1} bytes.')
+    else:
+        return len(encoded)
+
+#*Buffers (NumPy arrays, array.array, memoryview, bytearray, and bytes with the JSON codec) in args, kwargs or return_ don't go through the codec.
+#*Each codec's own hook swaps them for a marker in the payload and they're sent as their own frames with copy=False,
+#*so a big waveform is never converted to a list or copied on the way out. The hooks cost nothing when there aren't any buffers.
+#*On the way in memoryviews and NumPy arrays are read only views straight onto the received frame, no copy.
+#*bytearray and array.array need their own memory, so those get one copy when they're rebuilt.
+#*msgpack carries bytes, bytearray and memoryview natively in the payload (they come back as bytes), pickle carries bytes natively.
+_BUFFER_KEY = '__buffer__'
+
+def _buffer_marker(obj, buffers: list) -> dict:
+    """Adds obj to buffers and returns the marker that stands in for it in the payload. TypeError if obj isn't a buffer, like a json default function."""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        buffers.append(obj)
+        return {_BUFFER_KEY: len(buffers)-1, 'type': type(obj).__name__}
+    elif isinstance(obj, array.array):
+        buffers.append(obj)
+        return {_BUFFER_KEY: len(buffers)-1, 'type': 'array', 'typecode': obj.typecode}
+    elif type(obj).__module__ == 'numpy' and type(obj).__name__ == 'ndarray' and not obj.dtype.hasobject:
+        import numpy#only imported if someone is already sending arrays
+        buffers.append(numpy.ascontiguousarray(obj))#a no op unless it's a strided view
+        return {_BUFFER_KEY: len(buffers)-1, 'type': 'ndarray', 'dtype': obj.dtype.str, 'shape': list(obj.shape)}
+    else:
+        raise TypeError(f'Object of type {type(obj).__name__} can not be sent.')
+
+def _rebuild_buffer(marker: dict, buffers: list):
+    """The object_hook that turns markers back into buffers. Other dictionaries pass through."""
+    if _BUFFER_KEY not in marker:
+        return marker
+
+    view = memoryview(buffers[marker[_BUFFER_KEY]])
+    type_ = marker['type']
+    if type_ == 'memoryview':
+        return view
+    elif type_ == 'ndarray':
+        import numpy
+        return numpy.frombuffer(view, dtype=marker['dtype']).reshape(marker['shape'])
+    elif type_ == 'array':
+        return _array_from(marker['typecode'], view)
+    elif type_ == 'bytearray':
+        return bytearray(view)
+    else:
+        return bytes(view)
+
+def _array_from(typecode: str, buffer) -> array.array:
+    array_ = array.array(typecode)
+    array_.frombytes(buffer)
+    return array_
+
+class _BufferPickler(pickle.Pickler):
+    """Pickles memoryview and array.array out of band too. NumPy arrays and bytearray already support it."""
+    def reducer_override(self, obj):
+        if type(obj) is memoryview:
+            return memoryview, (pickle.PickleBuffer(obj),)
+        elif type(obj) is array.array:
+            return _array_from, (obj.typecode, pickle.PickleBuffer(obj))
+        else:
+            return NotImplemented
+
+class _Codec:
+    name = None
+    codec_id = None
+
+    def __init__(self) -> None:
+        #*Doesn't compress until it's given a compressor, but always decompresses what comes in compressed
+        self.compression = Compression()
+
+    def encode(self, message: ZMQMessage) -> list:
+        buffers = []
+        payload = self._dumps([message.args, message.kwargs, message.return_], buffers)
+        payload, compressor_id = self.compression.compress(payload)
+        return [self.encode_header(message, len(buffers), compressor_id), payload, *buffers]
+
+    def decode(self, frames: list) -> ZMQMessage:
+        """Decodes one message from its header, payload and buffer frames. The frames can be bytes or zmq.Frame."""
+        message, buffer_count, compressor_id = self.decode_header(frames[0])
+        buffers = [memoryview(frame) for frame in frames[2:2+buffer_count]]
+        payload = memoryview(frames[1])
+        if compressor_id:
+            payload = memoryview(self.compression.decompress(payload, compressor_id))
+        message.args, message.kwargs, message.return_ = self._loads(payload, buffers)
+        return message
+
+    def decode_many(self, frames: list) -> List[ZMQMessage]:
+        """Decodes a batch, the frames of each message one after another."""
+        messages = []
+        i = 0
+        while i < len(frames):
+            buffer_count = _HEADER.unpack_from(frames[i])[-1]
+            messages.append(self.decode(frames[i:i+2+buffer_count]))
+            i += 2 + buffer_count
+        return messages
+
+    def encode_header(self, message: ZMQMessage, buffer_count=0, compressor_id=0) -> bytes:
+        server, client, function, status = (_pack_string(string) for string in (message.server, message.client, message.function, message.status))
+
+        flags = compressor_id << _COMPRESSION_SHIFT
+        if message.dont_log_args:
+            flags |= _FLAG_DONT_LOG_ARGS
+        if message.dont_log_return:
+            flags |= _FLAG_DONT_LOG_RETURN
+        if message.id_ is None:
+            flags |= _FLAG_NO_ID
+
+        header = _HEADER.pack(
+            self.codec_id,
+            0 if message.id_ is None else message.id_,
+            flags,
+            _string_length(message.server, server),
+            _string_length(message.client, client),
+            _string_length(message.function, function),
+            _string_length(message.status, status),
+            len(message.times),
+            buffer_count,
+        )
+        times = struct.pack(f'!{len(message.times)}d', *message.times)
+
+        return b''.join((header, server, client, function, status, times))
+
+    def decode_header(self, header) -> tuple:
+        """Returns the message without its payload, the number of buffer frames that follow the payload and the id of the compressor the payload was compressed with."""
+        header = memoryview(header)
+        codec_id, id_, flags, *lengths, time_count, buffer_count = _HEADER.unpack_from(header)
+        if codec_id != self.codec_id:
+            raise ValueError(f'Received a message encoded with codec id {codec_id}, expected {self.codec_id} ({self.name}).')
+
+        offset = _HEADER.size
+        strings = []
+        for length in lengths:
+            if length == _NONE_LENGTH:
+                strings.append(None)
+            else:
+                strings.append(str(header[offset:offset+length], 'utf-8'))
+                offset += length
+        server, client, function, status = strings
+
+        times = list(struct.unpack_from(f'!{time_count}d', header, offset))
+
+        message = ZMQMessage(server=server, client=client, function=function, status=status, times=times,
+                             id_=None if flags & _FLAG_NO_ID else id_,
+                             dont_log_args=bool(flags & _FLAG_DONT_LOG_ARGS), dont_log_return=bool(flags & _FLAG_DONT_LOG_RETURN))
+        return message, buffer_count, (flags & _COMPRESSION_MASK) >> _COMPRESSION_SHIFT
+
+    def _dumps(self, payload: list, buffers: list) -> bytes:
+        """Encodes the payload, appending any out-of-band buffers to buffers."""
+        raise NotImplementedError
+
+    def _loads(self, payload: memoryview, buffers: List[memoryview]) -> list:
+        raise NotImplementedError
+
+class JSONCodec(_Codec):
+    name = 'json'
+    codec_id = 0
+
+    def _dumps(self, payload: list, buffers: list) -> bytes:
+        return json.dumps(payload, default=lambda obj: _buffer_marker(obj, buffers)).encode('utf-8')
+
+    def _loads(self, payload: memoryview, buffers: List[memoryview]) -> list:
+        if buffers:
+            return json.loads(bytes(payload), object_hook=lambda dict_: _rebuild_buffer(dict_, buffers))
+        else:
+            return json.loads(bytes(payload))
+
+class MsgpackCodec(_Codec):
+    name = 'msgpack'
+    codec_id = 1
+
+    def __init__(self) -> None:
+        if msgpack is None:
+            raise ImportError('The msgpack codec needs the msgpack package. pip install msgpack')
+        super().__init__()
+
+    def _dumps(self, payload: list, buffers: list) -> bytes:
+        return msgpack.packb(payload, use_bin_type=True, default=lambda obj: _buffer_marker(obj, buffers))
+
+    def _loads(self, payload: memoryview, buffers: List[memoryview]) -> list:
+        if buffers:
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False, object_hook=lambda dict_: _rebuild_buffer(dict_, buffers))
+        else:
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+class PickleCodec(_Codec):
+    """Pickle protocol 5. Carries tuples, sets and anything else picklable unchanged, buffers go out of band.
+    Only use this between processes you trust, unpickling can run arbitrary code.
+    """
+    name = 'pickle'
+    codec_id = 2
+
+    def _dumps(self, payload: list, buffers: list) -> bytes:
+        file = io.BytesIO()
+        _BufferPickler(file, protocol=5, buffer_callback=lambda buffer: buffers.append(buffer.raw())).dump(payload)
+        return file.getvalue()
+
+    def _loads(self, payload: memoryview, buffers: List[memoryview]) -> list:
+        return pickle.loads(payload, buffers=buffers)
+
+CODECS = {
+    JSONCodec.name: JSONCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    PickleCodec.name: PickleCodec,
+}
+
+#*Every multipart message starts with a topic frame. The server publishes with the name of the client it's meant for, or 'all'.
+#*Clients only subscribe to their own name and 'all', so libzmq drops everyone else's traffic before it's ever decoded.
+#*The topic ends in a null byte because subscriptions are prefix matches, without it 'test' would also get 'test2's messages.
+#*Clients publish with their own name as the topic, the server subscribes to everything.
+ALL = 'all'
+
+def topic(name: str) -> bytes:
+    return name.encode('utf-8') + b'\x00'
+
+ALL_TOPIC = topic(ALL)
+
+#*Transports. The server binds every transport it's given so each client can connect with whichever is fastest for it:
+#*  tcp for other machines and for subprocess executables, ipc (unix domain sockets) for processes on the same box,
+#*  and inproc for threads in the same process, which also needs them to share a context (zmq.Context.instance()).
+#*ipc and inproc addresses are made from the port so every server still has its own.
+TRANSPORTS = ('tcp', 'ipc', 'inproc')
+
+def available_transports() -> List[str]:
+    return [transport for transport in TRANSPORTS if transport != 'ipc' or zmq.has('ipc')]
+
+def endpoint(transport: str, address: str, port: int) -> str:
+    if transport == 'tcp':
+        return f'tcp://{address}:{port}'
+    elif transport == 'ipc':
+        return f'ipc://{Path(tempfile.gettempdir()) / f"zmq-{port}"}'
+    elif transport == 'inproc':
+        return f'inproc://zmq-{port}'
+    else:
+        raise ValueError(f'Unknown transport "{transport}". Options are {TRANSPORTS}.')
+
+def _shared_context(context_class) -> zmq.Context:
+    """The process wide context, so inproc works between any servers and clients in the process.
+    zmq.asyncio sockets get a shadow of the same context, so sync and async ones can still reach each other over inproc.
+    """
+    if context_class is zmq.Context:
+        return zmq.Context.instance()
+    else:
+        return context_class(zmq.Context.instance())
+
+def _unpack_call(call) -> tuple:
+    """Turns a call from send_batch into (function, args, kwargs)."""
+    if isinstance(call, str):
+        return call, [], {}
+    else:
+        function, *rest = call
+        args = rest[0] if len(rest) > 0 else []
+        kwargs = rest[1] if len(rest) > 1 else {}
+        return function, args, kwargs
+
+def get_codec(codec):
+    """Returns a codec instance from a name in CODECS, or passes an already made codec through."""
+    if isinstance(codec, str):
+        if codec not in CODECS:
+            raise KeyError(f'Unknown codec "{codec}". Options are {list(CODECS)}.')
+        return CODECS[codec]()
+    else:
+        return codec
+
+#*Launching multiprocess clients.
+#*By default clients are forked straight from the server on Linux, which is the fastest start there is, everything's already imported.
+#*Elsewhere it's the platform's default, spawn on Windows and macOS (where fork isn't safe), and every client imports everything itself.
+#*ZMQServer.start_method = 'forkserver' forks clients from a forkserver instead. It imports PRELOAD once when it starts,
+#*__main__ included so the main script and whatever it imports (the GUI stack) isn't imported again by every client.
+#*Against spawn that's much faster, against fork it's slower (the forkserver itself has to start first), but the clients don't inherit
+#*the server's threads and sockets. Like spawn it needs every target and argument to pickle.
+PRELOAD = ['__main__', 'zmq', 'loguru', 'yaml', 'utilities', 'utilities_log', 'utilities_zmq']
+
+def launcher(start_method:str=None, preload:List[str]=PRELOAD):
+    """The multiprocessing context clients are started with. None is fork on Linux and the platform's default elsewhere.
+    preload only counts with 'forkserver' and until the forkserver has started, which is the first time a client is started with it.
+    """
+    if start_method is None:
+        start_method = 'fork' if sys.platform.startswith('linux') else mp.get_start_method()
+    context = mp.get_context(start_method)
+    if start_method == 'forkserver':
+        context.set_forkserver_preload(list(preload))
+    return context
+
+def _start_client(target, args: tuple, kwargs: dict, cpus:List[int]=None, nice:int=None):
+    """Runs first in a new client process, pinning and renicing it before the client starts."""
+    if cpus is not None:
+        try:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpus)
+            elif psutil is not None:
+                psutil.Process().cpu_affinity(list(cpus))
+            else:
+                logger.warning(f'Can\'t pin {args[2]} to {cpus} without psutil.')
+        except Exception:
+            logger.exception(f'Error pinning {args[2]} to {cpus}.')
+
+    if nice is not None:
+        try:
+            if hasattr(os, 'setpriority'):
+                os.setpriority(os.PRIO_PROCESS, 0, nice)
+            elif psutil is not None:
+                psutil.Process().nice(nice)
+            else:
+                logger.warning(f'Can\'t set the niceness of {args[2]} without psutil.')
+        except Exception:
+            logger.exception(f'Error setting the niceness of {args[2]} to {nice}.')
+
+    target(*args, **kwargs)
+
+def _accepted_kwargs(target, **kwargs) -> Dict[str, any]:
+    """Filters kwargs down to the ones target takes, so multiprocess targets that only take the ports and name keep working."""
+    try:
+        parameters = inspect.signature(target).parameters
+    except (TypeError, ValueError):
+        return {}
+
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values()):
+        return kwargs
+    else:
+        return {key: value for key, value in kwargs.items() if key in parameters}
+
+def _default_executor(target) -> str:
+    """The executor target starts its client with when it isn't passed one, None if it doesn't take one."""
+    try:
+        parameter = inspect.signature(target).parameters.get('executor')
+    except (TypeError, ValueError):
+        return None
+
+    return None if parameter is None or parameter.default is parameter.empty else parameter.default
+
+class ZMQFuture(Future):
+    """The reply to a ZMQServer.call. The result is the reply ZMQMessage, check its status like any other message.
+    If no reply comes back within the call's timeout the future gets a TimeoutError instead.
+
+    There's no background thread receiving, so result() and exception() receive on the server until this future is done.
+    """
+    def __init__(self, server, message: ZMQMessage, timeout) -> None:
+        super().__init__()
+        self._server = server
+        self.id_ = message.id_
+        self.client = message.client
+        self.function = message.function
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+
+    def result(self, timeout=None):
+        self._server.wait([self], timeout=timeout)
+        return super().result(timeout=0)
+
+    def exception(self, timeout=None):
+        self._server.wait([self], timeout=timeout)
+        return super().exception(timeout=0)
+
+class WorkerPool:
+    """Identical clients started under one service name by start_multiprocess(..., workers=n).
+    Each worker is an ordinary client named service_0, service_1, ... Calls to the service go to the worker with the fewest replies outstanding,
+    so an idle worker always gets the next call and a busy one isn't given more until it catches up.
+    """
+    def __init__(self, service: str, workers: List[str]) -> None:
+        self.service = service
+        self.workers = list(workers)
+        self.depth: Dict[str, int] = {worker: 0 for worker in self.workers}#calls sent to each worker that haven't been replied to
+        self._assigned: Dict[int, str] = {}#message id_ -> worker
+
+    def next_worker(self, client_dictionary: Dict[str, str]=None) -> str:
+        """The least loaded worker, the first one when there's a tie. Dead and unresponsive workers are passed over while any others are left."""
+        workers = self.workers
+        if client_dictionary is not None:
+            workers = [worker for worker in workers if client_dictionary.get(worker) not in ('dead', 'unresponsive')] or workers
+        return min(workers, key=self.depth.__getitem__)
+
+    def assign(self, id_: int, worker: str):
+        self._assigned[id_] = worker
+        self.depth[worker] += 1
+
+    def release(self, id_: int):
+        """A reply came back or its call timed out."""
+        worker = self._assigned.pop(id_, None)
+        if worker is not None:
+            self.depth[worker] -= 1
+
+    def forget(self, worker: str):
+        """The worker died or was restarted, none of the calls it had will be replied to."""
+        for id_ in [id_ for id_, assigned in self._assigned.items() if assigned == worker]:
+            del self._assigned[id_]
+        self.depth[worker] = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._assigned)
+
 class ZMQServer:
-    def __init__(self, server_name='main', send_address='127.0.0.1', send_port=5555, recv_address='127.0.0.1', recv_port=5556) -> None:
+    _context_class = zmq.Context
+
+    #*How start_multiprocess starts processes, see launcher. None is fork on Linux, 'forkserver' preloads self.preload.
+    start_method: str = None
+    preload: List[str] = PRELOAD
+
+    def __init__(self, server_name='main', send_address='127.0.0.1', send_port=5555, recv_address='127.0.0.1', recv_port=5556, codec='json', transports:List[str]=None, hwm:int=None, compression:str=None, compression_threshold=4096, flight_recorder=False) -> None:
+        """
+        Args:
+            hwm (int, optional): High water mark of both sockets, messages queued per client before zmq drops them. None keeps zmq's 1000. Defaults to None.
+            compression (str, optional): Compress payloads of at least compression_threshold bytes with one of utilities_compression.COMPRESSORS.
+                Clients started from here do the same. Compressed messages are always decompressed, whatever this is. Defaults to None.
+            compression_threshold (int, optional): Smallest payload in bytes worth compressing. Defaults to 4096.
+            flight_recorder (bool, optional): Keep the last few MB of messages in and out, see utilities_recorder. Clients started from here do the same. Defaults to False.
+        """
         self.server_name = server_name
         self.client_dictionary = {}
+        self.codec = get_codec(codec)
+        if compression is not None:
+            self.codec.compression = Compression(compression, compression_threshold)
 
         self.send_address = send_address
         self.send_port = send_port
         self.recv_address = recv_address
         self.recv_port = recv_port
 
-        self._context = zmq.Context()
+        #*Bind everything available unless told otherwise. Multiprocess clients use ipc when it's there, thread clients use inproc.
+        self.transports = available_transports() if transports is None else list(transports)
+        self.multiprocess_transport = 'ipc' if 'ipc' in self.transports else 'tcp'
+        self.thread_transport = 'inproc' if 'inproc' in self.transports else self.multiprocess_transport
+
+        self._context = _shared_context(self._context_class)
 
         self._pub_socket = self._context.socket(zmq.PUB)
-        self._pub_socket.bind(f'tcp://{send_address}:{send_port}')
+        if hwm is not None:
+            self._pub_socket.setsockopt(zmq.SNDHWM, hwm)
+        for transport in self.transports:
+            self._pub_socket.bind(endpoint(transport, send_address, send_port))
 
         self._sub_socket = self._context.socket(zmq.SUB)
         self._sub_socket.setsockopt(zmq.SUBSCRIBE, b"")
-        self._sub_socket.bind(f'tcp://{recv_address}:{recv_port}')
+        if hwm is not None:
+            self._sub_socket.setsockopt(zmq.RCVHWM, hwm)
+        for transport in self.transports:
+            self._sub_socket.bind(endpoint(transport, recv_address, recv_port))
 
         self.next_message_id = 0
 
-    def send(self, client:str, function:str, args:List[any]=[], kwargs:Dict[str, any]={}, dont_log_args:bool=False):
+        #*Futures waiting for a reply, keyed by message id_, and a heap of their deadlines so timeouts are cheap to check
+        self._pending: Dict[int, ZMQFuture] = {}
+        self._deadlines = []
+        #*Messages received while waiting on futures that nobody has asked for yet. recv hands these out first.
+        self._backlog = deque()
+
+        #*Services run by several workers, by service name, and the pool each worker belongs to
+        self.pools: Dict[str, WorkerPool] = {}
+        self._worker_pools: Dict[str, WorkerPool] = {}
+
+        #*The process, thread or Popen of every client started here and how to start it again, for the heartbeat monitor
+        self.processes = {}
+        self._starters = {}
+        self.heartbeat: HeartbeatMonitor = None
+
+        #*Seconds from starting each client until it was ready, and when the ones that aren't ready yet were started
+        self.startup_times: Dict[str, float] = {}
+        self._launched: Dict[str, float] = {}
+
+        #*Flow control settings by client, service or None for everyone, and each client's FlowControl once something's been sent to it
+        self._flow_settings: Dict[str, dict] = {}
+        self.flows: Dict[str, FlowControl] = {}
+
+        #*Latency histograms of every message received, see utilities_latency
+        self.latency = LatencyStats()
+
+        #*The last few MB of messages in and out, dumped when a state fails. Copying every message in costs a little, so it's off unless asked for.
+        self.flight_recorder = FlightRecorder(server_name) if flight_recorder else None
+        #*Everything in and out, whole, while record_traffic is on
+        self.traffic_recorder: TrafficRecorder = None
+
+    def send(self, client:str, function:str, args:List[any]=[], kwargs:Dict[str, any]={}, dont_log_args:bool=False) -> ZMQMessage:
+        """Sends a function call. With flow control the message may be queued or dropped instead, dropped ones have the status 'dropped'."""
+        message = self._new_message(client, function, args, kwargs, dont_log_args)
+
+        self._send([message])
+
+        return message
+
+    def _send(self, messages: List[ZMQMessage]):
+        """Sends the messages as one multipart message, or queues, blocks or drops them according to the client's flow control."""
+        flow = self._flow(messages[0].client)
+        if flow is not None:
+            if flow.policy == 'block' and flow.full(len(messages)):
+                timeout_timer = Timer(flow.block_timeout)
+                while flow.full(len(messages)) and timeout_timer.running:
+                    self._receive(timeout=1)
+            if not flow.ready(len(messages)):
+                self._drop(flow.enqueue(messages))
+                return
+            flow.take(messages)
+
+        self._send_now(messages)
+
+    def _send_now(self, messages: List[ZMQMessage]):
+        self._pub_socket.send_multipart(self._encode(*messages), copy=False)
+
+        for message in messages:
+            trace_message('sent', message)
+
+    def _send_queued(self):
+        """Sends whatever flow control queued that there are credits for now."""
+        for flow in self.flows.values():
+            while flow.queue:
+                messages = flow.next_ready()
+                if messages is None:
+                    break
+                flow.take(messages)
+                self._send_now(messages)
+
+    def set_flow_control(self, client:str=None, credits=100, queue_size=1000, policy='block', block_timeout=10):
+        """Limits the calls waiting on a client, see utilities_flow.
+
+        Args:
+            client (str, optional): A client, a pool's service name for all its workers, or None for every client without its own. Defaults to None.
+            credits (int, optional): Calls that can be waiting on the client at once. Defaults to 100.
+            queue_size (int, optional): Sends held back once the credits are used up. Defaults to 1000.
+            policy (str, optional): 'block', 'drop-oldest' or 'drop-newest' when the queue is full. Defaults to 'block'.
+            block_timeout (float, optional): Seconds a 'block' send waits for room before dropping. Defaults to 10.
+        """
+        if policy not in FLOW_POLICIES:
+            raise ValueError(f'Unknown flow control policy "{policy}". Options are {FLOW_POLICIES}.')
+        self._flow_settings[client] = {'credits': credits, 'queue_size': queue_size, 'policy': policy, 'block_timeout': block_timeout}
+
+        #*Clients it covers pick the new settings up the next time something's sent to them
+        for name in list(self.flows):
+            if client is None or client in (name, self.service_of(name)):
+                if not self.flows[name].queue:
+                    del self.flows[name]
+
+    def _flow(self, client: str) -> FlowControl:
+        if not self._flow_settings or client == ALL:
+            return None
+
+        flow = self.flows.get(client)
+        if flow is None:
+            settings = self._flow_settings.get(client) or self._flow_settings.get(self.service_of(client)) or self._flow_settings.get(None)
+            if settings is None:
+                return None
+            flow = self.flows[client] = FlowControl(**settings)
+        return flow
+
+    def flow_stats(self) -> Dict[str, dict]:
+        """Sent, queued, dropped and in flight counts for each flow controlled client."""
+        return {client: flow.stats() for client, flow in self.flows.items()}
+
+    def compression_stats(self) -> dict:
+        """How much compression has saved and what it's cost in this process. Call a client's compression_stats for its side."""
+        return self.codec.compression.stats.stats()
+
+    def _compression_kwargs(self) -> Dict[str, any]:
+        compression = self.codec.compression
+        return {} if compression.name is None else {'compression': compression.name, 'compression_threshold': compression.threshold}
+
+    def _flight_recorder_kwargs(self) -> Dict[str, any]:
+        return {} if self.flight_recorder is None else {'flight_recorder': True}
+
+    def _drop(self, messages: List[ZMQMessage]):
+        for message in messages:
+            message.status = 'dropped'
+            self._release(message.client, message.id_)
+            future = self._pending.pop(message.id_, None)
+            if future is not None and not future.done():
+                future.set_exception(MessageDropped(f'{message.function} to {message.client} was dropped by flow control.'))
+            trace_message('dropped', message)
+
+    def _new_message(self, client:str, function:str, args:List[any], kwargs:Dict[str, any], dont_log_args:bool) -> ZMQMessage:
+        client = self._resolve(client)
         message = ZMQMessage(client=client, function=function, args=args, kwargs=kwargs, dont_log_args=dont_log_args)
 
         message.server = self.server_name
@@ -69,21 +685,259 @@ class ZMQServer:
         message.id_ = self.next_message_id
         self.next_message_id = (self.next_message_id+1)%10000000
 
-        self._pub_socket.send_json(message.__dict__)
+        pool = self._worker_pools.get(client)
+        if pool is not None:
+            pool.assign(message.id_, client)
+
+        return message
 
-        logger.trace('sent ' + str(message))
+    def _resolve(self, client: str) -> str:
+        """Picks a worker when client is a pool's service name, anything else is sent to as is."""
+        pool = self.pools.get(client)
+        return client if pool is None else pool.next_worker(self.client_dictionary)
+
+    def _release(self, client: str, id_: int, expired=False):
+        """Gives back the worker load and flow control credit of a call. An expired one that's still queued never goes out at all."""
+        pool = self._worker_pools.get(client)
+        if pool is not None:
+            pool.release(id_)
+        flow = self.flows.get(client)
+        if flow is not None:
+            if not flow.release(id_) and expired and flow.queue:
+                flow.discard(id_)
+
+    def service_of(self, client: str) -> str:
+        """The service a worker belongs to, or the client itself if it isn't in a pool."""
+        pool = self._worker_pools.get(client)
+        return client if pool is None else pool.service
+
+    def _encode(self, *messages: ZMQMessage) -> List[bytes]:
+        """One multipart message with the topic of the first message's client. More than one message makes a batch."""
+        frames = [topic(messages[0].client)]
+        for message in messages:
+            frames.extend(self.codec.encode(message))
+
+        #*Everything that's encoded gets sent, so this is where the recorders see outgoing messages
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(SENT, frames)
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.record(SENT, frames)
+
+        return frames
+
+    def _decode(self, frames: List[bytes]) -> List[ZMQMessage]:
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(RECEIVED, frames)
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.record(RECEIVED, frames)
+
+        _, *frames = frames
+        messages = self.codec.decode_many(frames)
+
+        #*Heartbeats only say the client is alive, they aren't handed out
+        received = []
+        now = time.time()
+        for message in messages:
+            heartbeat = message.function == HEARTBEAT and message.id_ == -1
+            if heartbeat and self.client_dictionary.get(message.client) == 'not_started':
+                self._client_ready(message.client)#clients heartbeat as soon as their run loop starts
+            if self.heartbeat is not None:
+                self.heartbeat.seen(message.client)
+            if not heartbeat:
+                message.times.append(now)
+                self._release(message.client, message.id_)
+                trace_message('recv', message)
+                received.append(message)
+
+        return received
+
+    def record_traffic(self, path=None) -> TrafficRecorder:
+        """Appends every message sent and received from now on to a capture that utilities_replay can play back.
+        The default path is logs/traffic/server_name time.bin. Recording stops with stop_recording_traffic or close.
+        """
+        self.stop_recording_traffic()
+        if path is None:
+            path = Path('logs/traffic') / f'{self.server_name} {datetime.now().strftime("%Y-%m-%d %H-%M-%S")}.bin'
+        self.traffic_recorder = TrafficRecorder(path)
+        logger.info(f'Recording traffic to {self.traffic_recorder.path}')
+        return self.traffic_recorder
+
+    def stop_recording_traffic(self):
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.close()
+            self.traffic_recorder = None
+
+    def enable_heartbeats(self, interval=0.25, missed=3, respawn=False, backoff=0.5, max_backoff=30, hang_timeout=None) -> HeartbeatMonitor:
+        """Keeps client_dictionary up to date with which clients are alive, see utilities_heartbeat.
+        A client that misses missed heartbeats in a row is 'unresponsive', one whose process has exited is 'dead'.
+        Clients started after this heartbeat every interval seconds, ones started before keep their own interval (ZMQClient defaults to 0.25).
+
+        Args:
+            respawn (bool, optional): Start dead clients again the way they were first started, waiting backoff seconds, doubling up to max_backoff. Defaults to False.
+            hang_timeout (float, optional): Terminate clients unresponsive this long so they die and are respawned. None leaves them. Defaults to None.
+        """
+        self.heartbeat = HeartbeatMonitor(self, interval=interval, missed=missed, respawn=respawn, backoff=backoff, max_backoff=max_backoff, hang_timeout=hang_timeout)
+        return self.heartbeat
+
+    def _client_ready(self, client: str):
+        self.client_dictionary[client] = 'ready'
+        launched = self._launched.pop(client, None)
+        if launched is not None:
+            self.startup_times[client] = time.monotonic() - launched
+            logger.debug(f'{client} started in {self.startup_times[client]*1000:.1f} ms')
+
+    def restart_client(self, client: str):
+        """Starts a client again the way it was first started. Calls the old one hadn't replied to fail with ClientDied."""
+        process = self.processes.get(client)
+        if process is not None and hasattr(process, 'terminate'):
+            process.terminate()
+        self._forget_client(client)
+        self._starters[client]()
+
+    def _forget_client(self, client: str):
+        """Drops everything outstanding with a client whose process is gone, so it doesn't look busy forever after it comes back."""
+        pool = self._worker_pools.get(client)
+        if pool is not None:
+            pool.forget(client)
+
+        for id_, future in list(self._pending.items()):
+            if future.client == client:
+                del self._pending[id_]
+                if not future.done():
+                    future.set_exception(ClientDied(f'{client} died before replying to {future.function}.'))
+
+        #*Sends queued for it are dropped too, they'd go out before the new one has subscribed
+        flow = self.flows.get(client)
+        if flow is not None:
+            self._drop(flow.reset())
+
+    def send_batch(self, client:str, calls:List[tuple], dont_log_args:bool=False) -> List[ZMQMessage]:
+        """Sends several function calls to one client in a single multipart message. The client runs them and replies in one batch too.
+
+        Args:
+            client (str): The client to call
+            calls (List[tuple]): Each call is a function name or a tuple of (function, args, kwargs), args and kwargs are optional like state returns
+            dont_log_args (bool, optional): Defaults to False.
+
+        Returns:
+            List[ZMQMessage]: The messages sent
+        """
+        client = self._resolve(client)#a batch goes to one worker
+        messages = [self._new_message(client, *_unpack_call(call), dont_log_args) for call in calls]
+
+        if messages:
+            self._send(messages)
+
+        return messages
+
+    def call(self, client:str, function:str, args:List[any]=[], kwargs:Dict[str, any]={}, dont_log_args:bool=False, timeout=10) -> ZMQFuture:
+        """Sends a function call and returns a future for its reply, so many calls can be in flight at once.
+
+        Args:
+            client (str): The client to call
+            function (str): The name of the client method
+            args (List[any], optional): Defaults to [].
+            kwargs (Dict[str, any], optional): Defaults to {}.
+            dont_log_args (bool, optional): Defaults to False.
+            timeout (float, optional): Seconds until the future fails with a TimeoutError. None waits forever. Defaults to 10.
+
+        Returns:
+            ZMQFuture: Resolves to the reply ZMQMessage
+        """
+        message = self.send(client, function, args=args, kwargs=kwargs, dont_log_args=dont_log_args)
+
+        return self._track(message, timeout)
+
+    def call_batch(self, client:str, calls:List[tuple], dont_log_args:bool=False, timeout=10) -> List[ZMQFuture]:
+        """send_batch, but returns a future for each call like call does."""
+        return [self._track(message, timeout) for message in self.send_batch(client, calls, dont_log_args=dont_log_args)]
+
+    def _track(self, message: ZMQMessage, timeout) -> ZMQFuture:
+        future = ZMQFuture(self, message, timeout)
+        self._pending[future.id_] = future
+        if message.status == 'dropped':
+            self._drop([message])
+        elif future.deadline is not None:
+            heapq.heappush(self._deadlines, (future.deadline, future.id_))
+
+        return future
+
+    def wait(self, futures: List[ZMQFuture], timeout=None) -> bool:
+        """Receives until all the futures are done or the timeout runs out. Other messages are kept for recv.
+
+        Returns:
+            bool: True if all the futures are done
+        """
+        timeout_timer = None if timeout is None else Timer(timeout)
+        while not all(future.done() for future in futures):
+            if timeout_timer is not None and timeout_timer.finished:
+                return False
+
+            self._receive()
+
+        return True
 
     def recv(self, timeout=10):
-        if self._sub_socket.poll(timeout=timeout):
-            message = ZMQMessage(**self._sub_socket.recv_json())
+        if not self._backlog:
+            self._receive(timeout=timeout)
 
-            message.times.append(time.time())
+        if self._backlog:
+            return self._backlog.popleft()
+        else:
+            return NULL_MESSAGE
 
-            logger.trace('recv ' + str(message))
+    def recv_many(self, max_messages=100, timeout=10) -> List[ZMQMessage]:
+        """Returns every message that's ready, up to max_messages, waiting up to timeout milliseconds for the first one.
 
-            return message
-        else:
-            return ZMQMessage()#null message
+        Returns:
+            List[ZMQMessage]: Empty if nothing arrived
+        """
+        if not self._backlog:
+            self._receive(timeout=timeout)
+
+        while len(self._backlog) < max_messages:
+            try:
+                self._route(self._sub_socket.recv_multipart(zmq.NOBLOCK, copy=False))
+            except zmq.Again:
+                break
+
+        return [self._backlog.popleft() for _ in range(min(max_messages, len(self._backlog)))]
+
+    def _receive(self, timeout=10):
+        """Waits up to timeout milliseconds and receives one multipart message into the backlog."""
+        if self._deadlines:
+            self._expire_futures()
+            if self.flows:
+                self._send_queued()
+        if self.heartbeat is not None:
+            self.heartbeat.check()
+
+        if self._sub_socket.poll(timeout=timeout):
+            self._route(self._sub_socket.recv_multipart(copy=False))
+
+    def _route(self, frames: List[bytes]):
+        """Replies to calls go to their futures, everything else goes in the backlog for recv."""
+        for message in self._decode(frames):
+            self.latency.record(message)
+            future = self._pending.pop(message.id_, None)
+            if future is None:
+                self._backlog.append(message)
+            elif not future.done():#it may have been cancelled
+                future.set_result(message)
+
+        if self.flows:
+            self._send_queued()
+
+    def _expire_futures(self):
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, id_ = heapq.heappop(self._deadlines)
+            future = self._pending.get(id_)
+            if future is not None and future.deadline <= now:
+                del self._pending[id_]
+                self._release(future.client, id_, expired=True)
+                if not future.done():
+                    future.set_exception(TimeoutError(f'Timed out waiting for {future.client} to reply to {future.function}.'))
 
     def recv_blocking(self, timeout=10):
         timeout_timer = Timer(timeout)
@@ -95,24 +949,82 @@ class ZMQServer:
 
     def wait_for_function(self, client_wanted, function_wanted, timeout=10):
         timeout_timer = Timer(timeout)
-        while timeout_timer.running:
-            message = self.recv()
-            if message.client == client_wanted and message.function == function_wanted:
-                return message
-        else:
-            logger.error(f'Timed out waiting for response')
+        skipped = []#messages that aren't the one we want go back to the backlog instead of being dropped
+        try:
+            while timeout_timer.running:
+                message = self.recv()
+                if self._is_wanted(message, client_wanted, function_wanted):
+                    return message
+                elif message is not NULL_MESSAGE:
+                    skipped.append(message)
+            else:
+                logger.error(f'Timed out waiting for response')
+        finally:
+            self._backlog.extendleft(reversed(skipped))
 
     def start_subprocess(self, executable, folder, process_name):
         path = Path(folder)
         executable_path = path / executable
-        subprocess.Popen([executable_path, process_name], cwd=path)
+        self._launched[process_name] = time.monotonic()
+        self.processes[process_name] = subprocess.Popen([executable_path, process_name], cwd=path)
+        self._starters[process_name] = partial(self.start_subprocess, executable, folder, process_name)
 
         self.client_dictionary[process_name] = 'not_started'
 
-    def start_multiprocess(self, multiprocess, process_name):
-        process = mp.Process(target=multiprocess, args=(self.send_port, self.recv_port, process_name), daemon=True)
+    def start_multiprocess(self, multiprocess, process_name, transport:str=None, daemon:bool=None, workers:int=None, cpus:List[int]=None, nice:int=None):
+        """Starts a client in its own process. It connects over ipc when the server has it, otherwise tcp, unless transport says otherwise.
+        Targets that don't take a transport argument connect over tcp like they always have.
+        Daemon processes can't start processes of their own, so daemon=None makes the process a daemon unless the target's executor defaults to 'process'
+        (a ZMQClient subclass that sets it, or a partial with executor='process'). Targets that pick it some other way need daemon=False.
+        The client's trace log is set up the same way as this process's.
+        The process comes from launcher(self.start_method), forked from this one on Linux unless start_method says otherwise.
+        How long it took to be ready ends up in self.startup_times.
+
+        With workers, that many copies are started as a WorkerPool in self.pools. Send and call to process_name like any other client
+        and each call goes to the least loaded worker. The workers show up in client_dictionary as process_name_0, process_name_1, ...
+
+        Args:
+            cpus (List[int], optional): CPU cores the client may run on. Workers get one each, going round cpus. None runs anywhere. Defaults to None.
+            nice (int, optional): The client's niceness, higher is lower priority. With psutil on Windows this is a priority class. Defaults to None.
+        """
+        if workers is not None:
+            names = [f'{process_name}_{index}' for index in range(workers)]
+            pool = self.pools[process_name] = WorkerPool(process_name, names)
+            for index, name in enumerate(names):
+                self._worker_pools[name] = pool
+                worker_cpus = None if cpus is None else [cpus[index % len(cpus)]]
+                self.start_multiprocess(multiprocess, name, transport=transport, daemon=daemon, cpus=worker_cpus, nice=nice)
+            return
+
+        transport = self.multiprocess_transport if transport is None else transport
+        kwargs = _accepted_kwargs(multiprocess, codec=self.codec.name, transport=transport, trace=trace_setting(), **self._heartbeat_kwargs(), **self._compression_kwargs(), **self._flight_recorder_kwargs())
+        args = (self.send_port, self.recv_port, process_name)
+
+        if daemon is None:
+            daemon = _default_executor(multiprocess) != 'process'
+
+        self._launched[process_name] = time.monotonic()
+        context = launcher(self.start_method, self.preload)
+        process = context.Process(target=_start_client, args=(multiprocess, args, kwargs, cpus, nice), daemon=daemon, name=process_name)
         process.start()
 
+        self.processes[process_name] = process
+        self._starters[process_name] = partial(self.start_multiprocess, multiprocess, process_name, transport=transport, daemon=daemon, cpus=cpus, nice=nice)
+        self.client_dictionary[process_name] = 'not_started'
+
+    def _heartbeat_kwargs(self) -> Dict[str, any]:
+        return {} if self.heartbeat is None else {'heartbeat': self.heartbeat.interval}
+
+    def start_thread(self, target, process_name, transport:str=None):
+        """Starts a client in a thread of this process, connected over inproc. The client shares this process's log instead of starting its own."""
+        transport = self.thread_transport if transport is None else transport
+        kwargs = _accepted_kwargs(target, codec=self.codec.name, transport=transport, start_log=False, **self._heartbeat_kwargs(), **self._compression_kwargs(), **self._flight_recorder_kwargs())
+        self._launched[process_name] = time.monotonic()
+        thread = threading.Thread(target=target, args=(self.send_port, self.recv_port, process_name), kwargs=kwargs, daemon=True, name=process_name)
+        thread.start()
+
+        self.processes[process_name] = thread
+        self._starters[process_name] = partial(self.start_thread, target, process_name, transport=transport)
         self.client_dictionary[process_name] = 'not_started'
 
     def wait_for_all_clients_ready(self, timeout=10):
@@ -126,44 +1038,166 @@ class ZMQServer:
                 ping_timer.reset()
                 self.send('all', 'ping')
 
-            if message.function == 'ping':
-                if message.return_ == 'pong':
-                    if message.status == 'loading':
-                        self.client_dictionary[message.client] = 'loading'
-                    elif message.status == 'success':
-                        self.client_dictionary[message.client] = 'ready'
-
-            if all([value == 'ready' for value in self.client_dictionary.values()]):
+            self._update_client(message)
+            if self._all_clients('ready'):
                 break
         else:
             raise Exception(f'Timed out waiting for clients. {self.client_dictionary}')
 
     def close(self, timeout=10):
         timeout_timer = Timer(timeout)
+        self._closing()
 
         self.send('all', 'close')
 
         while timeout_timer.running:
             message = self.recv()
 
-            if message.function == 'close':
-                if message.status == 'success':
-                    self.client_dictionary[message.client] = 'closed'#True means connected
-
-            if all([value == 'closed' for value in self.client_dictionary.values()]):
+            self._update_client(message)
+            if self._all_clients('closed'):
                 break
         else:
             raise Exception(f'Timed out waiting for clients. {self.client_dictionary}')
-        
+
+        self.stop_recording_traffic()
+
+    #*What wait_for_all_clients_ready, close and wait_for_function do with each message, shared with AsyncZMQServer
+    def _update_client(self, message: ZMQMessage):
+        """Keeps client_dictionary up to date from the replies to ping and close."""
+        if message.function == 'ping':
+            if message.return_ == 'pong':
+                if message.status == 'loading':
+                    self.client_dictionary[message.client] = 'loading'
+                elif message.status == 'success':
+                    self._client_ready(message.client)
+
+        elif message.function == 'close':
+            if message.status == 'success':
+                self.client_dictionary[message.client] = 'closed'
+
+    def _all_clients(self, state: str) -> bool:
+        return all(value == state for value in self.client_dictionary.values())
+
+    def _closing(self):
+        #*Clients exit as they close, that isn't dying
+        self.heartbeat = None
+
+    def _is_wanted(self, message: ZMQMessage, client_wanted: str, function_wanted: str) -> bool:
+        return client_wanted in (message.client, self.service_of(message.client)) and message.function == function_wanted
+
 class StateMachine(ZMQServer):
-    def __init__(self, server_name='main', send_address='127.0.0.1', send_port=5555, recv_address='127.0.0.1', recv_port=5556) -> None:
-        log_start(server_name)
+    def __init__(self, server_name='main', send_address='127.0.0.1', send_port=5555, recv_address='127.0.0.1', recv_port=5556, codec='json', transports:List[str]=None, trace=100, hwm:int=None, compression:str=None, compression_threshold=4096, flight_recorder=False) -> None:
+        """
+        Args:
+            trace (int, optional): 1 traces every message, n traces one in n, 0 turns the trace log off. Clients started from here do the same. Defaults to 100.
+        """
+        log_start(server_name, trace=trace)
         self.state_name = 'init'
+        self._event_loop = None
+        self._reactor = None
+        self._message_handlers = {}#(client, function) -> handler, None matches anything
         try:
-            super().__init__(server_name=server_name, send_address=send_address, send_port=send_port, recv_address=recv_address, recv_port=recv_port)
+            super().__init__(server_name=server_name, send_address=send_address, send_port=send_port, recv_address=recv_address, recv_port=recv_port, codec=codec, transports=transports, hwm=hwm,
+                             compression=compression, compression_threshold=compression_threshold, flight_recorder=flight_recorder)
+            self.latency.dump_path = f'logs/latency/{server_name} latency.json'
         except Exception:
             logger.exception('Initialization error.')
 
+    @property
+    def reactor(self) -> Reactor:
+        """The event loop for sync states, see utilities_reactor and react."""
+        if self._reactor is None:
+            self._reactor = Reactor()
+        return self._reactor
+
+    def on_message(self, handler, client:str=None, function:str=None):
+        """While react is running, messages from client calling function go to handler(message) instead of the backlog.
+        None matches any client or function, the most specific handler wins. Replies to calls go to their futures as usual,
+        use future.add_done_callback to handle those.
+        """
+        self._message_handlers[(client, function)] = handler
+
+    def react(self, timeout:float=None):
+        """Runs the reactor for the current state: messages go to the on_message handlers, and timers and futures time out
+        exactly when they're due, with nothing waking up in between. A callback ends it with self.reactor.stop(next_state).
+        The state's handlers, timers and readers are all removed when it returns.
+
+            def main_state(self):
+                self.on_message(self.handle_message)
+                self.reactor.add_gui(self.gui.update)
+                self.reactor.call_every(5, self.check_pressure)
+                return self.react()
+
+        Returns:
+            any: What was passed to stop, so the state can return it as the next state. None if it timed out.
+        """
+        reactor = self.reactor
+        reactor.add_reader(self._sub_socket, self._on_readable)
+        reactor.add_hook(self._housekeeping)
+        try:
+            #*Anything received before now gets handled too, once it's running
+            reactor.call_later(0, self._dispatch)
+            return reactor.run(timeout=timeout)
+        finally:
+            reactor.clear()
+            self._message_handlers.clear()
+
+    def _on_readable(self, socket):
+        while True:
+            try:
+                self._route(self._sub_socket.recv_multipart(zmq.NOBLOCK, copy=False))
+            except zmq.Again:
+                break
+
+        self._dispatch()
+
+    def _dispatch(self):
+        if not self._message_handlers:
+            return
+
+        #*Stops handing out messages as soon as a handler stops the reactor, the rest are left for the next state
+        unhandled = []
+        while self._backlog and self._reactor.running:
+            message = self._backlog.popleft()
+            handler = self._handler_for(message)
+            if handler is None:
+                unhandled.append(message)
+            else:
+                handler(message)
+        self._backlog.extendleft(reversed(unhandled))
+
+    def _handler_for(self, message: ZMQMessage):
+        handlers = self._message_handlers
+        client = self.service_of(message.client)
+        for key in ((message.client, message.function), (client, message.function), (message.client, None), (client, None), (None, message.function), (None, None)):
+            handler = handlers.get(key)
+            if handler is not None:
+                return handler
+
+    def _housekeeping(self):
+        """Times out futures, sends what flow control freed up and checks heartbeats. Returns seconds until the next of those is due."""
+        if self._deadlines:
+            self._expire_futures()
+            if self.flows:
+                self._send_queued()
+        if self.heartbeat is not None:
+            self.heartbeat.check()
+
+        now = time.monotonic()
+        wait = None
+        if self._deadlines:
+            wait = self._deadlines[0][0] - now
+        if self.heartbeat is not None:
+            wait = self.heartbeat.next_check - now if wait is None else min(wait, self.heartbeat.next_check - now)
+        return wait
+
+    @property
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """The loop async def states run on. It's kept for the life of the state machine so tasks and async sockets carry over between states."""
+        if self._event_loop is None:
+            self._event_loop = asyncio.new_event_loop()
+        return self._event_loop
+
     def run(self):
         #*Set the first state to main state
         state = self.main_state
@@ -176,8 +1210,10 @@ class StateMachine(ZMQServer):
                 logger.debug(f'Entering {state.__name__}')
                 self.state_name = ' '.join(state.__name__.split('_')[:-1])
 
-                #*Call the state
+                #*Call the state, async def states are run to completion on the event loop
                 return_ = state(*args, **kwargs)
+                if inspect.isawaitable(return_):
+                    return_ = self.event_loop.run_until_complete(return_)
 
                 #*Get the next state if only one thing is returned
                 if not isinstance(return_, tuple):
@@ -209,6 +1245,7 @@ class StateMachine(ZMQServer):
                         assert isinstance(kwargs, dict)
                 
             except Exception:
+                self.dump_flight_recorder()
                 if self.state_name == 'main state':
                     logger.exception('Critical state machine error.')
                     return None
@@ -223,23 +1260,100 @@ class StateMachine(ZMQServer):
     def main_state(self):
         raise NotImplementedError
 
+    def dump_flight_recorder(self):
+        if self.flight_recorder is not None:
+            try:
+                self.flight_recorder.dump()
+            except Exception:
+                logger.exception('Error dumping the flight recorder.')
+
     def close(self):
         super().close()
 
+def _call_in_process(client_class, function_name: str, args: list, kwargs: dict) -> tuple:
+    """Runs a client method in an executor process. There's no client instance over there, so it has to be a staticmethod or classmethod."""
+    try:
+        return 'success', getattr(client_class, function_name)(*args, **kwargs)
+    except Exception:
+        return 'error', format_exc()
+
 class ZMQClient:
-    def __init__(self, recv_port=5555, send_port=5556, client_name='test', autorun=True) -> None:
-        log_start(client_name)
+    _context_class = zmq.Context
+
+    #*With an executor these still run inline in the run loop, so they never wait behind a long call
+    inline_functions = {'ping', 'close', 'dump_flight_recorder'}
+
+    def __init__(self, recv_port=5555, send_port=5556, client_name='test', autorun=True, codec='json', transport='tcp', address='localhost', start_log=True, executor:str=None, max_workers:int=None, trace=100, heartbeat=0.25, hwm:int=None, compression:str=None, compression_threshold=4096, flight_recorder=False) -> None:
+        """
+        Args:
+            executor (str, optional): None calls every method inline in the run loop, one at a time.
+                'thread' runs calls in a thread pool, good for methods that wait on instruments. They have to be thread safe and mustn't send on the sockets.
+                'process' runs calls in a process pool for CPU bound work. There's no client instance there, so those methods have to be a staticmethod or classmethod.
+                Either way replies go back as each call finishes and inline_functions are still called inline. Defaults to None.
+            max_workers (int, optional): Size of the pool. Defaults to the executor's default.
+            trace (int, optional): Passed to log_start, 1 traces every message, n traces one in n, 0 turns the trace log off. Defaults to 100.
+            heartbeat (float, optional): Seconds between heartbeats sent from the run loop so the server knows this client is alive. None sends none. Defaults to 0.25.
+            hwm (int, optional): High water mark of both sockets. None keeps zmq's 1000. Defaults to None.
+            compression (str, optional): Compress payloads of at least compression_threshold bytes, see ZMQServer. Defaults to None.
+            compression_threshold (int, optional): Smallest payload in bytes worth compressing. Defaults to 4096.
+            flight_recorder (bool, optional): Keep the last few MB of messages in and out, dumped if the run loop fails. Defaults to False.
+        """
+        if start_log:
+            log_start(client_name, trace=trace)
+
+        self.codec = get_codec(codec)
+        if compression is not None:
+            self.codec.compression = Compression(compression, compression_threshold)
+
+        self.client_name = client_name
+        self._topic = topic(client_name)
 
-        self._context = zmq.Context()
+        self.transport = transport
+        self._context = _shared_context(self._context_class)
 
         self._pub_socket = self._context.socket(zmq.PUB)
-        self._pub_socket.connect(f'tcp://localhost:{send_port}')
+        if hwm is not None:
+            self._pub_socket.setsockopt(zmq.SNDHWM, hwm)
+        self._pub_socket.connect(endpoint(transport, address, send_port))
 
         self._sub_socket = self._context.socket(zmq.SUB)
-        self._sub_socket.connect(f'tcp://localhost:{recv_port}')
-        self._sub_socket.setsockopt(zmq.SUBSCRIBE, b"")
-
-        self.client_name = client_name
+        if hwm is not None:
+            self._sub_socket.setsockopt(zmq.RCVHWM, hwm)
+        self._sub_socket.connect(endpoint(transport, address, recv_port))
+        self._sub_socket.setsockopt(zmq.SUBSCRIBE, self._topic)
+        self._sub_socket.setsockopt(zmq.SUBSCRIBE, ALL_TOPIC)
+
+        #*Messages that came in a batch and haven't been handed out by recv yet
+        self._backlog = deque()
+
+        #*The last few MB of messages in and out, dumped if the run loop fails or the server calls dump_flight_recorder
+        self.flight_recorder = FlightRecorder(client_name) if flight_recorder else None
+
+        #*Calls finished by the executor go in _completed and a byte on the wake socket pair gets the run loop out of its poll
+        self.executor = executor
+        if executor is None:
+            self._executor = None
+        elif executor == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=client_name)
+        elif executor == 'process':
+            #*The pool only starts its processes on the first call, which would kill the run loop then instead of the client now
+            if mp.current_process().daemon:
+                raise ValueError(f'{client_name} is in a daemon process, which can\'t start the processes executor="process" needs. Start it with start_multiprocess(..., daemon=False).')
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f'Unknown executor "{executor}". Options are None, "thread" or "process".')
+        self._completed = deque()
+        if self._executor is not None:
+            self._wake_recv, self._wake_send = socket.socketpair()
+            self._wake_recv.setblocking(False)
+            self._wake_send.setblocking(False)
+            self._poller = zmq.Poller()
+            self._poller.register(self._sub_socket, zmq.POLLIN)
+            self._poller.register(self._wake_recv, zmq.POLLIN)
+
+        #*The first heartbeat goes as soon as run starts, that tells the server this client is ready
+        self.heartbeat = heartbeat
+        self._heartbeat_timer = None if heartbeat is None else Timer(heartbeat, start_finished=True)
 
         self.closed = False
 
@@ -247,39 +1361,88 @@ class ZMQClient:
             self.run()
 
     def send(self, function:str=None, args:List[any]=[], kwargs:Dict[str, any]={}, status:str=None, dont_log_args:bool=False):
+        message = self._new_message(function, args, kwargs, status, dont_log_args)
+
+        self._pub_socket.send_multipart(self._encode(message), copy=False)
+
+        trace_message('sent', message)
+
+    def recv(self, timeout=10):
+        if not self._backlog and self._sub_socket.poll(timeout=timeout):
+            self._backlog.extend(self._decode(self._sub_socket.recv_multipart(copy=False)))
+
+        if self._backlog:
+            return self._backlog.popleft()
+        else:
+            return NULL_MESSAGE
+
+    def recv_many(self, max_messages=100, timeout=10) -> List[ZMQMessage]:
+        """Returns every message that's ready, up to max_messages, waiting up to timeout milliseconds for the first one.
+
+        Returns:
+            List[ZMQMessage]: Empty if nothing arrived
+        """
+        if not self._backlog and self._sub_socket.poll(timeout=timeout):
+            self._backlog.extend(self._decode(self._sub_socket.recv_multipart(copy=False)))
+
+        while len(self._backlog) < max_messages:
+            try:
+                self._backlog.extend(self._decode(self._sub_socket.recv_multipart(zmq.NOBLOCK, copy=False)))
+            except zmq.Again:
+                break
+
+        return [self._backlog.popleft() for _ in range(min(max_messages, len(self._backlog)))]
+
+    def return_(self, message: ZMQMessage):
+        self.return_many([message])
+
+    def return_many(self, messages: List[ZMQMessage]):
+        """Replies to several messages in a single multipart message."""
+        now = time.time()
+        for message in messages:
+            message.times.append(now)
+
+        self._pub_socket.send_multipart(self._encode(*messages), copy=False)
+
+        for message in messages:
+            trace_message('sent', message)
+
+    def _new_message(self, function:str, args:List[any], kwargs:Dict[str, any], status:str, dont_log_args:bool) -> ZMQMessage:
         message = ZMQMessage(function=function, args=args, kwargs=kwargs, status=status, dont_log_args=dont_log_args)
 
         message.client = self.client_name
         message.times = [time.time()]
         message.id_ = -1#this indicates a message originating from the client
 
-        self._pub_socket.send_json(message.__dict__)
+        return message
 
-        logger.trace('sent ' + str(message))
+    def _encode(self, *messages: ZMQMessage) -> List[bytes]:
+        frames = [self._topic]
+        for message in messages:
+            frames.extend(self.codec.encode(message))
 
-    def recv(self, timeout=10):
-        if self._sub_socket.poll(timeout=timeout):
-            message = ZMQMessage(**self._sub_socket.recv_json())
-            if message.client == self.client_name or message.client == 'all':
-                if message.client == 'all':
-                    message.client = self.client_name
-                    
-                message.times.append(time.time())
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(SENT, frames)
 
-                logger.trace('recv ' + str(message))
+        return frames
 
-                return message
-            else:
-                return ZMQMessage()
-        else:
-            return ZMQMessage()#null message
+    def _decode(self, frames: List[bytes]) -> List[ZMQMessage]:
+        if self.flight_recorder is not None:
+            self.flight_recorder.record(RECEIVED, frames)
 
-    def return_(self, message: ZMQMessage):
-        message.times.append(time.time())
+        #*Only our own and 'all' topics get through the subscription, so there's nothing to filter here
+        topic_, *frames = frames
+        messages = self.codec.decode_many(frames)
+        broadcast = memoryview(topic_) == ALL_TOPIC
 
-        self._pub_socket.send_json(message.__dict__)
+        now = time.time()
+        for message in messages:
+            if broadcast:
+                message.client = self.client_name
+            message.times.append(now)
+            trace_message('recv', message)
 
-        logger.trace('sent ' + str(message))
+        return messages
 
     def call(self, message: ZMQMessage):
         message.times.append(time.time())
@@ -299,21 +1462,115 @@ class ZMQClient:
             else:
                 message.status = 'success'
 
+        #*Stamp the end of the call too, replies can wait a little to go out in a batch and that shouldn't count as execution
+        message.times.append(time.time())
+
         return message
-    
+
+    def _submit(self, message: ZMQMessage):
+        """Hands a call to the executor. Its reply is picked up by the run loop when it finishes."""
+        if not callable(getattr(self, message.function, None)):
+            message.status = 'invalid_function'
+            now = time.time()
+            message.times.extend((now, now))
+            self._finish(message)
+        elif self.executor == 'process':
+            message.times.append(time.time())
+            future = self._executor.submit(_call_in_process, type(self), message.function, message.args, message.kwargs)
+            future.add_done_callback(lambda future: self._process_done(message, future))
+        else:
+            future = self._executor.submit(self.call, message)
+            future.add_done_callback(lambda future: self._finish(future.result()))
+
+    def _process_done(self, message: ZMQMessage, future: Future):
+        try:
+            message.status, message.return_ = future.result()
+        except Exception:#the pool broke or the arguments couldn't be pickled
+            logger.exception(message.function)
+            message.status = 'error'
+            message.return_ = format_exc()
+        message.times.append(time.time())
+        self._finish(message)
+
+    def _finish(self, message: ZMQMessage):
+        """Called from executor threads. deque.append is thread safe, the sockets aren't, so the run loop does the sending."""
+        self._completed.append(message)
+        try:
+            self._wake_send.send(b'\x00')
+        except BlockingIOError:#already plenty of wake ups waiting
+            pass
+
+    def _wait_for_messages(self, timeout=10) -> List[ZMQMessage]:
+        if self._executor is None:
+            return self.recv_many(timeout=timeout)
+        else:
+            if not self._backlog and not self._completed:
+                for socket_, _ in self._poller.poll(timeout):
+                    if socket_ is self._wake_recv:
+                        try:
+                            self._wake_recv.recv(4096)
+                        except BlockingIOError:
+                            pass
+            return self.recv_many(timeout=0)
+
     def run(self):
         try:
             while not self.closed:
-                message = self.recv()
-                if message.function:
-                    message = self.call(message)
-                    self.return_(message)
+                if self._heartbeat_timer is not None and self._heartbeat_timer.finished:
+                    self._heartbeat_timer.reset()
+                    self.send(HEARTBEAT)
+
+                #*Everything that's ready gets run and the replies go back together
+                replies = []
+                for message in self._wait_for_messages():
+                    if message.function:
+                        if self._executor is None or message.function in self.inline_functions:
+                            replies.append(self.call(message))
+                        else:
+                            self._submit(message)
+
+                while self._completed:
+                    replies.append(self._completed.popleft())
+
+                if replies:
+                    self.return_many(replies)
+
+            #*Let anything still running finish and reply
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                if self._completed:
+                    self.return_many(list(self._completed))
         except Exception as e:
+            self.dump_flight_recorder()
             self.send(status='error', args=[str(e)])
             logger.exception('error')
+        finally:
+            self._close_sockets()
+
+    def _close_sockets(self, linger=1000):
+        """Closes the sockets, giving the last replies (like the one to close) up to linger milliseconds to go out.
+        A client on the main thread is the whole process and it can exit as soon as run returns, which would drop anything still queued,
+        so it waits for them by destroying the context. Thread clients share the context with the server, they just close their sockets.
+        """
+        if threading.current_thread() is threading.main_thread():
+            self._context.destroy(linger=linger)
+        else:
+            self._pub_socket.close(linger=linger)
+            self._sub_socket.close(linger=0)
 
     def ping(self):
         return 'pong'
+
+    def compression_stats(self) -> dict:
+        return self.codec.compression.stats.stats()
+
+    def dump_flight_recorder(self) -> str:
+        """Writes the flight recorder to logs/flight. The server can call this to get a client's side of things. Returns the file written."""
+        if self.flight_recorder is not None:
+            try:
+                return str(self.flight_recorder.dump())
+            except Exception:
+                logger.exception('Error dumping the flight recorder.')
     
     def close(self):
         self.closed = True
@@ -0,0 +1,346 @@
+#*asyncio versions of ZMQServer, ZMQClient and StateMachine built on zmq.asyncio.
+#*They use the same messages, codecs and topics, so async and sync clients can talk to either kind of server.
+#*Everything that touches a socket is a coroutine, the rest (start_multiprocess, client_dictionary, ...) is inherited unchanged.
+
+import time
+import asyncio
+import inspect
+from typing import List, Dict
+from traceback import format_exc
+
+import zmq
+import zmq.asyncio
+from loguru import logger
+
+from utilities import Timer
+from utilities_log import trace_message
+from utilities_heartbeat import HEARTBEAT
+from utilities_flow import MessageDropped
+from utilities_zmq import ZMQMessage, NULL_MESSAGE, ZMQServer, ZMQClient, StateMachine, _unpack_call
+
+class AsyncZMQServer(ZMQServer):
+    _context_class = zmq.asyncio.Context
+
+    #*A single reader task owns the sub socket. Replies go to their call's future, everything else goes to the inbox for recv.
+    #*Both are made on first use so they belong to the running loop.
+    _reader = None
+    _inbox = None
+    _room = None#set by the reader when replies free up flow control credits
+
+    def _start_reader(self):
+        if self._reader is None or self._reader.done():
+            if self._inbox is None:
+                self._inbox = asyncio.Queue()
+                self._room = asyncio.Event()
+            self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        while True:
+            try:
+                messages = self._decode(await self._sub_socket.recv_multipart(copy=False))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Error decoding a message.')
+                continue
+
+            for message in messages:
+                self.latency.record(message)
+                future = self._pending.pop(message.id_, None)
+                if future is None:
+                    self._inbox.put_nowait(message)
+                elif not future.done():#it may have been cancelled or timed out
+                    future.set_result(message)
+
+            if self.flows:
+                await self._send_queued()
+                self._room.set()
+
+    async def send(self, client:str, function:str, args:List[any]=[], kwargs:Dict[str, any]={}, dont_log_args:bool=False) -> ZMQMessage:
+        message = self._new_message(client, function, args, kwargs, dont_log_args)
+
+        await self._send([message])
+
+        return message
+
+    async def _send(self, messages: List[ZMQMessage]):
+        flow = self._flow(messages[0].client)
+        if flow is not None:
+            if flow.policy == 'block' and flow.full(len(messages)):
+                self._start_reader()
+                try:
+                    async with asyncio.timeout(flow.block_timeout):
+                        while flow.full(len(messages)):
+                            self._room.clear()
+                            await self._room.wait()
+                except TimeoutError:
+                    pass
+            if not flow.ready(len(messages)):
+                self._drop(flow.enqueue(messages))
+                return
+            flow.take(messages)
+
+        await self._send_now(messages)
+
+    async def _send_now(self, messages: List[ZMQMessage]):
+        await self._pub_socket.send_multipart(self._encode(*messages), copy=False)
+
+        for message in messages:
+            trace_message('sent', message)
+
+    async def _send_queued(self):
+        for flow in self.flows.values():
+            while flow.queue:
+                messages = flow.next_ready()
+                if messages is None:
+                    break
+                flow.take(messages)
+                await self._send_now(messages)
+
+    async def send_batch(self, client:str, calls:List[tuple], dont_log_args:bool=False) -> List[ZMQMessage]:
+        client = self._resolve(client)#a batch goes to one worker
+        messages = [self._new_message(client, *_unpack_call(call), dont_log_args) for call in calls]
+
+        if messages:
+            await self._send(messages)
+
+        return messages
+
+    async def call(self, client:str, function:str, args:List[any]=[], kwargs:Dict[str, any]={}, dont_log_args:bool=False, timeout=10) -> ZMQMessage:
+        """Sends a function call and waits for its reply. Run many with asyncio.gather to have them all in flight at once.
+
+        Raises:
+            TimeoutError: If no reply came back within timeout seconds
+        """
+        self._start_reader()
+
+        message = await self.send(client, function, args=args, kwargs=kwargs, dont_log_args=dont_log_args)
+        if message.status == 'dropped':
+            raise MessageDropped(f'{function} to {client} was dropped by flow control.')
+
+        future = asyncio.get_running_loop().create_future()
+        future.client, future.function = message.client, function#like a ZMQFuture, so _forget_client can fail it
+        self._pending[message.id_] = future
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        except TimeoutError:
+            self._release(message.client, message.id_, expired=True)
+            if self.flows:
+                await self._send_queued()
+            raise TimeoutError(f'Timed out waiting for {client} to reply to {function}.')
+        finally:
+            self._pending.pop(message.id_, None)
+
+    async def wait(self, futures, timeout=None) -> bool:
+        """Waits until all the futures (or call coroutines) are done or the timeout runs out.
+
+        Returns:
+            bool: True if they're all done
+        """
+        _, pending = await asyncio.wait([asyncio.ensure_future(future) for future in futures], timeout=timeout)
+        return not pending
+
+    async def recv(self, timeout=10):
+        """Waits up to timeout milliseconds for a message that isn't a reply to a call. None waits forever."""
+        self._start_reader()
+        if self.heartbeat is not None:
+            self.heartbeat.check()
+
+        try:
+            async with asyncio.timeout(None if timeout is None else timeout/1000):
+                return await self._inbox.get()
+        except TimeoutError:
+            return NULL_MESSAGE
+
+    async def recv_many(self, max_messages=100, timeout=10) -> List[ZMQMessage]:
+        messages = [await self.recv(timeout=timeout)]
+        if messages[0] is NULL_MESSAGE:
+            return []
+
+        while len(messages) < max_messages and not self._inbox.empty():
+            messages.append(self._inbox.get_nowait())
+
+        return messages
+
+    async def recv_blocking(self, timeout=10):
+        message = await self.recv(timeout=timeout*1000)
+        if message is NULL_MESSAGE:
+            logger.error(f'Timed out waiting for response')
+        else:
+            return message
+
+    async def wait_for_function(self, client_wanted, function_wanted, timeout=10):
+        timeout_timer = Timer(timeout)
+        skipped = []#messages that aren't the one we want go back in the inbox instead of being dropped
+        try:
+            while timeout_timer.running:
+                message = await self.recv()
+                if self._is_wanted(message, client_wanted, function_wanted):
+                    return message
+                elif message is not NULL_MESSAGE:
+                    skipped.append(message)
+            else:
+                logger.error(f'Timed out waiting for response')
+        finally:
+            for message in skipped:
+                self._inbox.put_nowait(message)
+
+    async def wait_for_all_clients_ready(self, timeout=10):
+        ping_timer = Timer(1)
+        timeout_timer = Timer(timeout)
+
+        while timeout_timer.running:
+            message = await self.recv()
+
+            if ping_timer.finished:
+                ping_timer.reset()
+                await self.send('all', 'ping')
+
+            self._update_client(message)
+            if self._all_clients('ready'):
+                break
+        else:
+            raise Exception(f'Timed out waiting for clients. {self.client_dictionary}')
+
+    async def close(self, timeout=10):
+        timeout_timer = Timer(timeout)
+        self._closing()
+
+        await self.send('all', 'close')
+
+        while timeout_timer.running:
+            message = await self.recv()
+
+            self._update_client(message)
+            if self._all_clients('closed'):
+                break
+        else:
+            raise Exception(f'Timed out waiting for clients. {self.client_dictionary}')
+
+        if self._reader is not None:
+            self._reader.cancel()
+
+        self.stop_recording_traffic()
+
+class AsyncStateMachine(StateMachine, AsyncZMQServer):
+    """A StateMachine whose states are async def and use the awaitable send/recv/call.
+    Sync states still work, they just can't await anything.
+    """
+    def close(self):
+        self.event_loop.run_until_complete(AsyncZMQServer.close(self))
+
+class AsyncZMQClient(ZMQClient):
+    """A ZMQClient whose run loop handles calls to async def methods concurrently.
+    Each call to a coroutine method gets its own task and replies as soon as it finishes, so a slow call doesn't hold up the others.
+    Plain methods are still called inline, they block the loop while they run.
+    """
+    _context_class = zmq.asyncio.Context
+
+    def __init__(self, recv_port=5555, send_port=5556, client_name='test', autorun=True, codec='json', transport='tcp', address='localhost', start_log=True, trace=100, heartbeat=0.25, hwm:int=None, compression:str=None, compression_threshold=4096, flight_recorder=False) -> None:
+        super().__init__(recv_port=recv_port, send_port=send_port, client_name=client_name, autorun=False, codec=codec, transport=transport, address=address, start_log=start_log, trace=trace, heartbeat=heartbeat, hwm=hwm,
+                         compression=compression, compression_threshold=compression_threshold, flight_recorder=flight_recorder)
+
+        if autorun:
+            asyncio.run(self.run())
+
+    async def send(self, function:str=None, args:List[any]=[], kwargs:Dict[str, any]={}, status:str=None, dont_log_args:bool=False):
+        message = self._new_message(function, args, kwargs, status, dont_log_args)
+
+        await self._pub_socket.send_multipart(self._encode(message), copy=False)
+
+        trace_message('sent', message)
+
+    async def recv(self, timeout=10):
+        if not self._backlog and await self._sub_socket.poll(timeout=timeout):
+            self._backlog.extend(self._decode(await self._sub_socket.recv_multipart(copy=False)))
+
+        if self._backlog:
+            return self._backlog.popleft()
+        else:
+            return NULL_MESSAGE
+
+    async def recv_many(self, max_messages=100, timeout=10) -> List[ZMQMessage]:
+        if not self._backlog and await self._sub_socket.poll(timeout=timeout):
+            self._backlog.extend(self._decode(await self._sub_socket.recv_multipart(copy=False)))
+
+        while len(self._backlog) < max_messages:
+            try:
+                self._backlog.extend(self._decode(await self._sub_socket.recv_multipart(zmq.NOBLOCK, copy=False)))
+            except zmq.Again:
+                break
+
+        return [self._backlog.popleft() for _ in range(min(max_messages, len(self._backlog)))]
+
+    async def return_(self, message: ZMQMessage):
+        await self.return_many([message])
+
+    async def return_many(self, messages: List[ZMQMessage]):
+        now = time.time()
+        for message in messages:
+            message.times.append(now)
+
+        await self._pub_socket.send_multipart(self._encode(*messages), copy=False)
+
+        for message in messages:
+            trace_message('sent', message)
+
+    async def call(self, message: ZMQMessage):
+        message.times.append(time.time())
+        #*Get the function to call. This should send and log an attribute error if it fails
+        try:
+            function = getattr(self, message.function)
+        except Exception:
+            message.status = 'invalid_function'
+        else:
+            #*Call the function with or without arguments, awaiting it if it's a coroutine
+            try:
+                return_ = function(*message.args, **message.kwargs)
+                if inspect.isawaitable(return_):
+                    return_ = await return_
+                message.return_ = return_
+            except Exception:
+                logger.exception(message.function)
+                message.status = 'error'
+                message.return_ = format_exc()
+            else:
+                message.status = 'success'
+
+        message.times.append(time.time())
+
+        return message
+
+    async def _call_and_return(self, message: ZMQMessage):
+        await self.return_(await self.call(message))
+
+    async def _beat(self):
+        """Heartbeats from a task of their own, they keep going while coroutine calls run but not while a plain method blocks the loop."""
+        while True:
+            await self.send(HEARTBEAT)
+            await asyncio.sleep(self.heartbeat)
+
+    async def run(self):
+        tasks = set()
+        beat = None if self.heartbeat is None else asyncio.ensure_future(self._beat())
+        try:
+            while not self.closed:
+                message = await self.recv(timeout=None)
+                if message.function:
+                    if inspect.iscoroutinefunction(getattr(self, message.function, None)):
+                        task = asyncio.ensure_future(self._call_and_return(message))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    else:
+                        await self._call_and_return(message)
+
+            #*Let calls that are still running finish and reply before leaving
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except Exception as e:
+            self.dump_flight_recorder()
+            await self.send(status='error', args=[str(e)])
+            logger.exception('error')
+        finally:
+            if beat is not None:
+                beat.cancel()
+            self._close_sockets()